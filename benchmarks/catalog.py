@@ -0,0 +1,118 @@
+import random
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+NULL_KEY = "00000000-0000-0000-0000-000000000000"
+PART_FOLDER_NAME = "Запасные части"
+BRAND_NAMES = ["FOTON", "ASHOK", "KAMAZ", "MAZ"]
+RETAIL_PRICE_TYPE = "Розничная цена"
+FIRST_RECORD_PERIOD = datetime(2024, 1, 1)
+
+
+@dataclass(slots=True)
+class SyntheticCatalog:
+    folders: list[dict] = field(default_factory=list)
+    products: list[dict] = field(default_factory=list)
+    price_types: list[dict] = field(default_factory=list)
+    prices: list[dict] = field(default_factory=list)
+    stock: list[dict] = field(default_factory=list)
+    price_records: list[dict] = field(default_factory=list)
+    stock_records: list[dict] = field(default_factory=list)
+
+    @property
+    def entities(self) -> dict[str, list[dict]]:
+        return {
+            "Catalog_Номенклатура": self.folders + self.products,
+            "Catalog_ТипыЦен": self.price_types,
+            "InformationRegister_Цены_RecordType/SliceLast()": self.prices,
+            "AccumulationRegister_ОстаткиТоваровКомпании/Balance()": (
+                self.stock),
+            "InformationRegister_Цены_RecordType": self.price_records,
+            "AccumulationRegister_ОстаткиТоваровКомпании_RecordType": (
+                self.stock_records)
+        }
+
+
+def generate_catalog(
+        items_number: int, depth: int = 3, folders_number: int = 200,
+        in_stock_share: float = 0.7, seed: int = 0
+) -> SyntheticCatalog:
+    generator = random.Random(seed)
+    catalog = SyntheticCatalog()
+
+    def get_key() -> str:
+        return str(uuid.UUID(int=generator.getrandbits(128)))
+
+    def add_folder(name: str, parent_key: str) -> str:
+        key = get_key()
+        catalog.folders.append({
+            "Ref_Key": key, "Parent_Key": parent_key, "IsFolder": True,
+            "Description": name
+        })
+        return key
+
+    # Brands live both under the parts folder and under an unrelated root
+    # folder, so that the part folder filter has something to skip.
+    folder_levels: list[list[str]] = [[]]
+    for root_name in [PART_FOLDER_NAME, "Другое"]:
+        root_key = add_folder(root_name, NULL_KEY)
+        for brand_name in BRAND_NAMES:
+            folder_levels[0].append(add_folder(brand_name, root_key))
+
+    for level in range(1, depth):
+        folder_levels.append([])
+        level_folders_number = max(
+            1, (folders_number - len(catalog.folders)) // (depth - level))
+        for index in range(level_folders_number):
+            parent_key = generator.choice(folder_levels[level - 1])
+            folder_levels[level].append(
+                add_folder(f"Группа {level}.{index}", parent_key))
+
+    leaf_keys = [key for keys in folder_levels for key in keys]
+    for index in range(items_number):
+        sku = f"SKU-{index:07d}" if generator.random() > 0.02 else ""
+        catalog.products.append({
+            "Ref_Key": get_key(),
+            "Parent_Key": generator.choice(leaf_keys),
+            "IsFolder": False,
+            "Description": f"Деталь {index}",
+            "DataVersion": "AAAAAQAAAAA=",
+            "НаименованиеПолное": f"Деталь,номер,{index}",
+            "Артикул": sku
+        })
+
+    retail_price_type_key = get_key()
+    catalog.price_types = [
+        {"Ref_Key": retail_price_type_key, "Description": RETAIL_PRICE_TYPE},
+        {"Ref_Key": get_key(), "Description": "Оптовая цена"}
+    ]
+    for product in catalog.products:
+        for price_type in catalog.price_types:
+            catalog.prices.append({
+                "Номенклатура_Key": product["Ref_Key"],
+                "ТипЦен_Key": price_type["Ref_Key"],
+                "Цена": generator.randint(100, 100000)
+            })
+        if generator.random() < in_stock_share:
+            catalog.stock.append({
+                "Номенклатура_Key": product["Ref_Key"],
+                "КоличествоBalance": generator.randint(1, 50)
+            })
+
+    # Every price and balance gets the register record it came from, so
+    # the snapshot can look up the records made after a period.
+    def get_period() -> str:
+        return (FIRST_RECORD_PERIOD + timedelta(
+            seconds=generator.randrange(365 * 24 * 60 * 60))).isoformat()
+
+    catalog.price_records = [
+        {"Period": get_period(), "Номенклатура_Key": price["Номенклатура_Key"]}
+        for price in catalog.prices
+    ]
+    catalog.stock_records = [
+        {"Period": get_period(), "Номенклатура_Key": stock["Номенклатура_Key"]}
+        for stock in catalog.stock
+    ]
+
+    return catalog
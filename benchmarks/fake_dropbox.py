@@ -0,0 +1,75 @@
+import itertools
+import threading
+from types import SimpleNamespace
+
+from dropbox.exceptions import ApiError
+
+
+class FakeDropbox:
+    # Keeps uploaded files and shared links in memory and answers the
+    # subset of the Dropbox API used by DropboxImages.
+    def __init__(self, *args, **kwargs):
+        self.files: dict[str, bytes] = {}
+        self.links: dict[str, str] = {}
+        self.calls_number = 0
+        self._sessions: dict[str, list] = {}
+        self._session_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def files_upload(self, data: bytes, path: str, *args, **kwargs):
+        with self._lock:
+            self.calls_number += 1
+            self.files[path] = data
+
+    def files_upload_session_start(self, data: bytes, close: bool = False):
+        with self._lock:
+            self.calls_number += 1
+            session_id = str(next(self._session_ids))
+            self._sessions[session_id] = [bytes(data), close]
+        return SimpleNamespace(session_id=session_id)
+
+    def files_upload_session_append_v2(
+            self, data: bytes, cursor, close: bool = False):
+        with self._lock:
+            self.calls_number += 1
+            session = self._sessions[cursor.session_id]
+            session[0] += data
+            session[1] = close
+
+    def files_upload_session_finish_batch_v2(self, entries: list):
+        with self._lock:
+            self.calls_number += 1
+            results = []
+            for entry in entries:
+                data, _ = self._sessions.pop(entry.cursor.session_id)
+                self.files[entry.commit.path] = data
+                results.append(SimpleNamespace(is_failure=lambda: False))
+        return SimpleNamespace(entries=results)
+
+    def sharing_create_shared_link_with_settings(self, path: str, *args):
+        with self._lock:
+            self.calls_number += 1
+            if path in self.links:
+                raise ApiError("request", "shared_link_already_exists",
+                               "Shared link already exists", "en")
+            self.links[path] = f"https://www.dropbox.com/s/fake{path}?dl=0"
+            return SimpleNamespace(
+                url=self.links[path], path_lower=path.lower())
+
+    def sharing_list_shared_links(
+            self, path: str | None = None, cursor: str | None = None,
+            direct_only: bool | None = None):
+        with self._lock:
+            self.calls_number += 1
+            links = [
+                SimpleNamespace(url=url, path_lower=link_path.lower())
+                for link_path, url in self.links.items()
+                if path is None or link_path == path
+            ]
+        return SimpleNamespace(links=links, has_more=False, cursor=None)
+
+    def files_delete(self, path: str):
+        with self._lock:
+            self.calls_number += 1
+            self.files.pop(path, None)
+            self.links.pop(path, None)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import re
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Self
+from urllib.parse import parse_qs, unquote, urlsplit
+
+TOKEN_PATTERN = re.compile(
+    r"\s*(?:(?P<paren>[()])|(?P<operator>\band\b|\bor\b)|"
+    r"(?P<field>\w+)\s+(?P<comparison>eq|ne|ge|gt|le|lt)\s+"
+    r"(?P<value>guid'[^']*'|datetime'[^']*'|'[^']*'|true|false|"
+    r"-?\d+(?:\.\d+)?))")
+COMPARISONS: dict[str, Callable] = {
+    "eq": lambda left, right: left == right,
+    "ne": lambda left, right: left != right,
+    "ge": lambda left, right: left >= right,
+    "gt": lambda left, right: left > right,
+    "le": lambda left, right: left <= right,
+    "lt": lambda left, right: left < right
+}
+
+
+class ODataFilter:
+    # Supports the subset of $filter used by the client: comparisons
+    # joined with and/or and grouped with parentheses. An "or" of
+    # equalities is answered from a per-field index instead of a scan.
+    def __init__(self, expression: str):
+        self._tokens = self._tokenize(expression)
+        self._position = 0
+        self._node = self._parse_or()
+        if self._position != len(self._tokens):
+            raise ValueError(f"Unexpected token in the filter {expression}")
+
+    def apply(
+            self, rows: list[dict],
+            get_index: Callable[[str], dict[object, list[int]]]
+    ) -> list[dict]:
+        indexes = self._get_candidates(self._node, get_index)
+        if indexes is None:
+            candidates = rows
+        else:
+            candidates = [rows[index] for index in sorted(indexes)]
+        return [row for row in candidates if self._evaluate(self._node, row)]
+
+    @staticmethod
+    def _tokenize(expression: str) -> list[tuple]:
+        tokens = []
+        position = 0
+        expression = expression.strip()
+        while position < len(expression):
+            match = TOKEN_PATTERN.match(expression, position)
+            if match is None:
+                raise ValueError(f"Unsupported filter {expression}")
+            position = match.end()
+            if match["paren"]:
+                tokens.append(("paren", match["paren"]))
+            elif match["operator"]:
+                tokens.append(("operator", match["operator"]))
+            else:
+                tokens.append((
+                    "comparison", match["field"], match["comparison"],
+                    ODataFilter._parse_value(match["value"])))
+        return tokens
+
+    @staticmethod
+    def _parse_value(value: str) -> object:
+        if value in ("true", "false"):
+            return value == "true"
+        if value.startswith(("guid'", "datetime'")):
+            return value[value.index("'") + 1:-1]
+        if value.startswith("'"):
+            return value[1:-1]
+        return float(value)
+
+    def _parse_or(self) -> tuple:
+        nodes = [self._parse_and()]
+        while self._peek() == ("operator", "or"):
+            self._position += 1
+            nodes.append(self._parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def _parse_and(self) -> tuple:
+        nodes = [self._parse_primary()]
+        while self._peek() == ("operator", "and"):
+            self._position += 1
+            nodes.append(self._parse_primary())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def _parse_primary(self) -> tuple:
+        token = self._peek()
+        self._position += 1
+        if token == ("paren", "("):
+            node = self._parse_or()
+            if self._peek() != ("paren", ")"):
+                raise ValueError("Unbalanced parentheses in the filter")
+            self._position += 1
+            return node
+        if token is None or token[0] != "comparison":
+            raise ValueError(f"Unexpected token {token} in the filter")
+        return token
+
+    def _peek(self) -> tuple | None:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _evaluate(self, node: tuple, row: dict) -> bool:
+        if node[0] == "or":
+            return any(self._evaluate(child, row) for child in node[1])
+        if node[0] == "and":
+            return all(self._evaluate(child, row) for child in node[1])
+        _, field, comparison, value = node
+        return COMPARISONS[comparison](row.get(field), value)
+
+    def _get_candidates(
+            self, node: tuple,
+            get_index: Callable[[str], dict[object, list[int]]]
+    ) -> set[int] | None:
+        if node[0] == "comparison":
+            _, field, comparison, value = node
+            if comparison != "eq":
+                return None
+            return set(get_index(field).get(value, ()))
+
+        candidates = [
+            self._get_candidates(child, get_index) for child in node[1]]
+        if node[0] == "or":
+            if any(candidate is None for candidate in candidates):
+                return None
+            return set().union(*candidates)
+
+        candidates = [
+            candidate for candidate in candidates if candidate is not None]
+        if not candidates:
+            return None
+        return min(candidates, key=len)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # The client opens a pool of connections at once, which overflows the
+    # default listen backlog of five and stalls on SYN retransmits.
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class ODataStandInServer:
+    def __init__(self, entities: dict[str, list[dict]], port: int = 0):
+        self._entities = entities
+        self._indexes: dict[tuple[str, str], dict[object, list[int]]] = {}
+        self._indexes_lock = threading.Lock()
+        self.requests_number = 0
+        self._server = _HTTPServer(
+            ("127.0.0.1", port), self._get_handler_class())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/odata/standard.odata/"
+
+    def __enter__(self) -> Self:
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def query(self, entity_name: str, params: dict[str, str]) -> list[dict]:
+        rows = self._entities[entity_name]
+        if "$filter" in params:
+            rows = ODataFilter(params["$filter"]).apply(
+                rows, lambda field: self._get_index(entity_name, field))
+        if "$orderby" in params:
+            for order in reversed(params["$orderby"].split(",")):
+                field, _, direction = order.strip().partition(" ")
+                rows = sorted(
+                    rows, key=lambda row: row.get(field) or "",
+                    reverse=direction == "desc")
+        skip = int(params.get("$skip", 0))
+        top = params.get("$top")
+        rows = rows[skip:None if top is None else skip + int(top)]
+        if "$select" in params:
+            fields = params["$select"].split(",")
+            rows = [
+                {field: row[field] for field in fields if field in row}
+                for row in rows
+            ]
+        return rows
+
+    def _get_index(
+            self, entity_name: str, field: str) -> dict[object, list[int]]:
+        with self._indexes_lock:
+            index = self._indexes.get((entity_name, field))
+            if index is None:
+                index = defaultdict(list)
+                for position, row in enumerate(self._entities[entity_name]):
+                    index[row.get(field)].append(position)
+                self._indexes[(entity_name, field)] = index
+            return index
+
+    def _get_handler_class(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests_number += 1
+                url = urlsplit(self.path)
+                entity_name = unquote(url.path).split(
+                    "/odata/standard.odata/", 1)[-1]
+                params = {
+                    name: values[0]
+                    for name, values in parse_qs(url.query).items()
+                }
+                if entity_name not in server._entities:
+                    self.send_error(404)
+                    return
+
+                body = json.dumps(
+                    {"value": server.query(entity_name, params)},
+                    ensure_ascii=False).encode("utf-8")
+                etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable
+from unittest import mock
+
+# Settings are read from the environment when src.config is imported, so
+# the benchmark points them to a scratch directory beforehand.
+WORK_DIRECTORY = Path(tempfile.mkdtemp(prefix="autocube-benchmarks-"))
+for name, value in {
+    "LOGFILE": str(WORK_DIRECTORY / "benchmarks.log"),
+    "ODATA_URL": "http://127.0.0.1/odata/standard.odata/",
+    "ODATA_USERNAME": "benchmark",
+    "ODATA_PASSWORD": "benchmark",
+    "IMAGES_FOLDER": str(WORK_DIRECTORY / "images"),
+    "DEFAULT_IMAGE": "default.jpg",
+    "STATE_FILE": str(WORK_DIRECTORY / "state.pickle"),
+    "DROPBOX_REFRESH_TOKEN": "benchmark",
+    "DROPBOX_APP_KEY": "benchmark",
+    "DROPBOX_APP_SECRET": "benchmark",
+    "CSV_FILES_DIRECTORY": str(WORK_DIRECTORY / "csv"),
+    "TILDA_EMAIL": "benchmark",
+    "TILDA_PASSWORD": "benchmark",
+    "TILDA_PROJECT_ID": "0",
+    "SELENIUM_TIMEOUT": "10",
+    "SELENIUM_FILE_UPLOADING_TIMEOUT": "10",
+}.items():
+    os.environ[name] = value
+
+from loguru import logger  # noqa: E402
+
+from benchmarks.catalog import SyntheticCatalog, generate_catalog  # noqa
+from benchmarks.fake_dropbox import FakeDropbox  # noqa: E402
+from benchmarks.odata_server import ODataStandInServer  # noqa: E402
+from src import main as sync  # noqa: E402
+from src.config import settings  # noqa: E402
+from src.entities import Product, ProductWithImage  # noqa: E402
+from src.images import DropboxImages, ImagesFolder  # noqa: E402
+from src.odata_1c import OData1CEntities, OData1CMapper  # noqa: E402
+from src.state import SqliteState, State  # noqa: E402
+from src.tilda import TildaCsvFileManager  # noqa: E402
+
+BASELINES_FILE = Path(__file__).with_name("baselines.json")
+DEFAULT_SCALES = [10_000, 100_000]
+# The pickle state compares every item with every stored item, so it is
+# only measured on catalogs where that finishes in reasonable time.
+MAX_PICKLE_STATE_ITEMS = 10_000
+
+
+class BenchmarkScale:
+    def __init__(self, items_number: int, depth: int, folders_number: int):
+        self.items_number = items_number
+        # Extra figures of the benchmarks, printed next to their timings.
+        self.notes: dict[str, str] = {}
+        self.catalog = generate_catalog(
+            items_number, depth=depth, folders_number=folders_number)
+        self.catalog_entities = get_catalog_entities(self.catalog)
+        self.products: list[Product] = list(OData1CMapper(
+            self.catalog_entities, sync.map_single_product, single_pass=True
+        ).map_products())
+
+        self.directory = WORK_DIRECTORY / str(items_number)
+        self.images_directory = self.directory / "images"
+        self.csv_directory = self.directory / "csv"
+        self.images_directory.mkdir(parents=True)
+        self.csv_directory.mkdir()
+
+        # Every tenth product gets its own image, the rest fall back to
+        # the default one.
+        (self.images_directory / settings.default_image).write_bytes(b"0")
+        for index, product in enumerate(self.products[::10]):
+            path = self.images_directory / f"{product.sku}.jpg"
+            path.write_bytes(index.to_bytes(4, "big") * 64)
+        self.products_with_images: list[ProductWithImage] = list(
+            ImagesFolder(
+                self.images_directory, self.products, settings.default_image,
+                key=lambda product: product.sku
+            ).get_products_with_images())
+
+
+def get_catalog_entities(catalog: SyntheticCatalog) -> OData1CEntities:
+    prices = OData1CEntities(catalog.prices).expand_on(
+        OData1CEntities(catalog.price_types),
+        left_key="ТипЦен_Key", right_key="Ref_Key", key="ТипЦены")
+    products = OData1CEntities(catalog.products).expand_on(
+        prices, left_key="Ref_Key", right_key="Номенклатура_Key", key="Цены"
+    ).expand_on(
+        OData1CEntities(catalog.stock),
+        left_key="Ref_Key", right_key="Номенклатура_Key", key="Остаток")
+    return OData1CEntities(catalog.folders + products.entities)
+
+
+def measure(
+        function: Callable[[], object], repeat: int,
+        setup: Callable[[], object] | None = None
+) -> float:
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+def benchmark_get_products_from_1c(scale: BenchmarkScale, repeat: int):
+    with ODataStandInServer(scale.catalog.entities) as server, \
+            mock.patch.multiple(
+                settings, odata_url=server.url, odata_snapshot_file=None,
+                max_products_number=None):
+        seconds = measure(sync.get_products_from_1c, repeat)
+        scale.notes["get_products_from_1c"] = (
+            f"{server.requests_number // repeat} OData requests")
+        return seconds
+
+
+def benchmark_map_products(scale: BenchmarkScale, repeat: int):
+    return measure(
+        lambda: OData1CMapper(
+            scale.catalog_entities, sync.map_single_product,
+            single_pass=True
+        ).map_products(),
+        repeat
+    )
+
+
+def benchmark_map_products_batch(scale: BenchmarkScale, repeat: int):
+    return measure(
+        lambda: OData1CMapper(
+            scale.catalog_entities, sync.map_single_product,
+            map_products_batch=partial(
+                sync.map_products_batch, retail_price_types={})
+        ).map_products(),
+        repeat
+    )
+
+
+def benchmark_images_folder(scale: BenchmarkScale, repeat: int):
+    return measure(
+        lambda: ImagesFolder(
+            scale.images_directory, scale.products, settings.default_image,
+            key=lambda product: product.sku
+        ).get_products_with_images(),
+        repeat
+    )
+
+
+def benchmark_state_filter_not_presented(
+        scale: BenchmarkScale, repeat: int):
+    if scale.items_number > MAX_PICKLE_STATE_ITEMS:
+        return None
+    state = State(scale.directory / "state.pickle")
+    state.dump(scale.products_with_images[::2])
+    return measure(
+        lambda: state.filter_not_presented(scale.products_with_images),
+        repeat)
+
+
+def benchmark_sqlite_state_diff(scale: BenchmarkScale, repeat: int):
+    state = SqliteState(
+        scale.directory / "state.sqlite3",
+        key=lambda item: item.product.external_id,
+        volatile_fields=sync.VOLATILE_PRODUCT_FIELDS)
+    try:
+        state.dump(scale.products_with_images[::2])
+        return measure(
+            lambda: state.diff(scale.products_with_images), repeat)
+    finally:
+        state.close()
+
+
+def benchmark_dropbox_images(scale: BenchmarkScale, repeat: int):
+    def get_image_urls():
+        with mock.patch("src.images.dropbox.Dropbox", FakeDropbox):
+            dropbox_images = DropboxImages(
+                "benchmark", "benchmark", "benchmark", "/Запчасти",
+                scale.products_with_images,
+                scale.images_directory / settings.default_image,
+                max_workers=settings.dropbox_max_workers,
+                list_shared_links=True)
+        dropbox_images.get_products_with_image_urls()
+
+    return measure(get_image_urls, repeat)
+
+
+def benchmark_tilda_csv(scale: BenchmarkScale, repeat: int):
+    def remove_files():
+        for path in scale.csv_directory.iterdir():
+            path.unlink()
+
+    return measure(
+        lambda: TildaCsvFileManager(
+            scale.csv_directory, "import_{datetime}_{part}.csv",
+            scale.products,
+            max_rows_per_file=settings.csv_max_rows_per_file
+        ).create_files(),
+        repeat,
+        setup=remove_files
+    )
+
+
+BENCHMARKS: dict[str, Callable[[BenchmarkScale, int], float | None]] = {
+    "get_products_from_1c": benchmark_get_products_from_1c,
+    "map_products": benchmark_map_products,
+    "map_products_batch": benchmark_map_products_batch,
+    "images_folder": benchmark_images_folder,
+    "state_filter_not_presented": benchmark_state_filter_not_presented,
+    "sqlite_state_diff": benchmark_sqlite_state_diff,
+    "dropbox_images": benchmark_dropbox_images,
+    "tilda_csv": benchmark_tilda_csv,
+}
+
+
+def load_baselines() -> dict[str, float]:
+    if not BASELINES_FILE.is_file():
+        return {}
+    return json.loads(BASELINES_FILE.read_text("utf-8"))
+
+
+def save_baselines(baselines: dict[str, float]):
+    baselines = {key: round(seconds, 4) for key, seconds in baselines.items()}
+    BASELINES_FILE.write_text(
+        json.dumps(baselines, indent=2, sort_keys=True) + "\n", "utf-8")
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the sync on synthetic 1C catalogs.")
+    parser.add_argument(
+        "--scales", nargs="+", type=int, default=DEFAULT_SCALES,
+        help="numbers of items in the generated catalogs")
+    parser.add_argument("--depth", type=int, default=3,
+                        help="nesting depth of the folder tree")
+    parser.add_argument("--folders", type=int, default=200,
+                        help="number of folders in the catalog")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs per benchmark, the best one is kept")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS),
+                        help="run only the given benchmarks")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown relative to the baseline")
+    parser.add_argument("--absolute-tolerance", type=float, default=0.05,
+                        help="allowed slowdown in seconds on top of the "
+                             "relative one")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baselines")
+    return parser.parse_args()
+
+
+def main() -> int:
+    arguments = parse_arguments()
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+
+    baselines = load_baselines()
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<28}{'items':>9}{'seconds':>10}"
+          f"{'baseline':>10}{'ratio':>8}")
+    for items_number in arguments.scales:
+        scale = BenchmarkScale(
+            items_number, arguments.depth, arguments.folders)
+        for name, benchmark in BENCHMARKS.items():
+            if arguments.only is not None and name not in arguments.only:
+                continue
+            seconds = benchmark(scale, arguments.repeat)
+            if seconds is None:
+                print(f"{name:<28}{items_number:>9}{'skipped':>10}")
+                continue
+
+            key = f"{name}/{items_number}"
+            results[key] = seconds
+            note = scale.notes.get(name)
+            note = "" if note is None else f"  {note}"
+            baseline = baselines.get(key)
+            if baseline is None:
+                print(f"{name:<28}{items_number:>9}{seconds:>10.3f}{note}")
+                continue
+            ratio = seconds / baseline
+            # Millisecond timings jitter by more than the relative
+            # tolerance, so a regression must also exceed an absolute one.
+            is_regression = seconds > (
+                baseline * (1 + arguments.tolerance) +
+                arguments.absolute_tolerance)
+            if is_regression:
+                regressions.append(key)
+            print(f"{name:<28}{items_number:>9}{seconds:>10.3f}"
+                  f"{baseline:>10.3f}{ratio:>8.2f}"
+                  f"{'  REGRESSION' if is_regression else ''}{note}")
+
+    if arguments.save_baseline:
+        save_baselines(baselines | results)
+        print(f"Baselines were saved to {BASELINES_FILE}.")
+        return 0
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        shutil.rmtree(WORK_DIRECTORY, ignore_errors=True)
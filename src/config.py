@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -9,19 +11,48 @@ class Settings(BaseSettings):
     odata_url: str
     odata_username: str
     odata_password: str
-    max_products_number: int = 5000
+    odata_page_size: int | None = None
+    odata_timeout: float | None = None
+    odata_retries: int = 3
+    odata_max_filter_length: int = 2000
+    odata_snapshot_file: str | None = None
+    odata_compact_entities: bool = False
+    odata_cache_directory: str | None = None
+    odata_cache_max_age: float | None = None
+    odata_cache_retention: float = 7 * 24 * 60 * 60
+    odata_offline: bool = False
+    max_products_number: int | None = None
+    pipeline_queue_size: int = 1000
+    pipeline_batch_size: int = 100
+    sync_lock_file: str | None = None
+    daemon_refresh_interval: float = 15 * 60
+    daemon_full_sync_interval: float = 24 * 60 * 60
+    daemon_health_port: int | None = 8765
+    metrics_report_file: str | None = None
+    metrics_prometheus_file: str | None = None
     images_folder: str
     default_image: str
     state_file: str
+    state_database_file: str | None = None
     dropbox_refresh_token: str
     dropbox_app_key: str
     dropbox_app_secret: str
+    dropbox_max_workers: int = 4
+    dropbox_cache_file: str | None = None
     csv_files_directory: str
+    csv_max_rows_per_file: int | None = 5000
+    csv_max_file_size: int | None = None
+    tilda_differential_export: bool = False
     tilda_email: str
     tilda_password: str
     tilda_project_id: str
+    # The http uploader is experimental: its endpoints are not documented
+    # by Tilda and were not verified against the live service.
+    tilda_uploader: Literal["selenium", "http"] = "selenium"
     selenium_timeout: int
     selenium_file_uploading_timeout: int
+    selenium_user_data_dir: str | None = None
+    tilda_cookies_file: str | None = None
 
 
 settings = Settings()
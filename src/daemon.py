@@ -0,0 +1,266 @@
+import fcntl
+import json
+import os
+import signal
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Self, TextIO
+
+from loguru import logger
+
+
+class SyncLockedError(RuntimeError):
+    pass
+
+
+class FileLock:
+    def __init__(self, filepath: Path | str):
+        self._filepath = Path(filepath)
+        self._file: TextIO | None = None
+
+    def __enter__(self) -> Self:
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def acquire(self):
+        # The lock is held by the open file, so it is released by the
+        # system even if the process is killed.
+        file = self._filepath.open(mode="a", encoding="utf-8")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            raise SyncLockedError(
+                f"Lock file {self._filepath} is held by another "
+                f"synchronization.")
+        file.truncate(0)
+        file.write(f"{os.getpid()}\n")
+        file.flush()
+        self._file = file
+
+    def release(self):
+        if self._file is None:
+            return
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+@dataclass(slots=True)
+class DaemonStatus:
+    started_at: datetime
+    is_running: bool = False
+    runs_number: int = 0
+    failures_number: int = 0
+    skipped_runs_number: int = 0
+    last_run_started_at: datetime | None = None
+    last_run_finished_at: datetime | None = None
+    last_run_full_sync: bool | None = None
+    last_run_error: str | None = None
+    last_success_at: datetime | None = None
+    next_run_at: datetime | None = None
+    next_full_sync_at: datetime | None = None
+
+    @property
+    def is_healthy(self) -> bool:
+        return self.runs_number == 0 or self.last_run_error is None
+
+
+class SyncScheduler:
+    # Intervals are counted from the starts of the runs. A full sync also
+    # refreshes the stock and prices, so it postpones the next refresh.
+    def __init__(self, refresh_interval: float, full_sync_interval: float):
+        self._refresh_interval = refresh_interval
+        self._full_sync_interval = full_sync_interval
+        now = time.monotonic()
+        self._next_refresh_at = now
+        self._next_full_sync_at = now + full_sync_interval
+
+    def get_next_run(self) -> tuple[float, bool]:
+        if self._next_full_sync_at <= self._next_refresh_at:
+            return self._next_full_sync_at, True
+        return self._next_refresh_at, False
+
+    def mark_started(self, full_sync: bool, started_at: float):
+        self._next_refresh_at = started_at + self._refresh_interval
+        if full_sync:
+            self._next_full_sync_at = started_at + self._full_sync_interval
+
+    def mark_skipped(self, skipped_at: float):
+        # A skipped full sync is retried with the next refresh instead of
+        # waiting for the whole full sync interval.
+        self._next_refresh_at = skipped_at + self._refresh_interval
+        self._next_full_sync_at = max(
+            self._next_full_sync_at, self._next_refresh_at)
+
+    def get_wall_time(self, monotonic_time: float) -> datetime:
+        return datetime.now() + timedelta(
+            seconds=monotonic_time - time.monotonic())
+
+    @property
+    def next_full_sync_at(self) -> float:
+        return self._next_full_sync_at
+
+
+class HealthServer:
+    def __init__(
+            self, port: int, get_status: Callable[[], DaemonStatus],
+            get_metrics: Callable[[], str], host: str = "127.0.0.1"
+    ):
+        self._get_status = get_status
+        self._get_metrics = get_metrics
+        self._server = ThreadingHTTPServer(
+            (host, port), self._get_handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self) -> Self:
+        self._thread.start()
+        logger.info(f"Health endpoint is listening on {self.url}health.")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _get_handler_class(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/health":
+                    status = server._get_status()
+                    body = json.dumps(
+                        asdict(status) | {"is_healthy": status.is_healthy},
+                        ensure_ascii=False, default=str, indent=2)
+                    self._send(
+                        200 if status.is_healthy else 503, body,
+                        "application/json")
+                elif self.path == "/metrics":
+                    self._send(200, server._get_metrics(), "text/plain")
+                else:
+                    self.send_error(404)
+
+            def _send(self, code: int, body: str, content_type: str):
+                content = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header(
+                    "Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class SyncDaemon:
+    def __init__(
+            self, run_sync: Callable[[bool], None],
+            refresh_interval: float, full_sync_interval: float,
+            lock_file: Path | str | None = None,
+            health_port: int | None = None,
+            get_metrics: Callable[[], str] = lambda: ""
+    ):
+        self._run_sync = run_sync
+        self._scheduler = SyncScheduler(refresh_interval, full_sync_interval)
+        self._lock_file = lock_file
+        self._health_port = health_port
+        self._get_metrics = get_metrics
+        self._status = DaemonStatus(datetime.now())
+        self._status_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def get_status(self) -> DaemonStatus:
+        with self._status_lock:
+            return DaemonStatus(**asdict(self._status))
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *args: self.stop())
+
+        if self._health_port is None:
+            self._run_cycles()
+            return
+        with HealthServer(self._health_port, self.get_status,
+                          self._get_metrics):
+            self._run_cycles()
+
+    def _run_cycles(self):
+        logger.info("Synchronization daemon was started.")
+        while True:
+            run_at, full_sync = self._scheduler.get_next_run()
+            with self._status_lock:
+                self._status.next_run_at = self._scheduler.get_wall_time(
+                    run_at)
+                self._status.next_full_sync_at = (
+                    self._scheduler.get_wall_time(
+                        self._scheduler.next_full_sync_at))
+            if self._stop_event.wait(max(0.0, run_at - time.monotonic())):
+                break
+            started_at = time.monotonic()
+            if self._run_cycle(full_sync):
+                self._scheduler.mark_started(full_sync, started_at)
+            else:
+                self._scheduler.mark_skipped(started_at)
+        logger.info("Synchronization daemon was stopped.")
+
+    def _run_cycle(self, full_sync: bool) -> bool:
+        lock = nullcontext()
+        if self._lock_file is not None:
+            lock = FileLock(self._lock_file)
+        try:
+            with lock:
+                self._run_locked_cycle(full_sync)
+        except SyncLockedError as exception:
+            logger.warning(f"Scheduled synchronization was skipped. "
+                           f"{exception}")
+            with self._status_lock:
+                self._status.skipped_runs_number += 1
+            return False
+        return True
+
+    def _run_locked_cycle(self, full_sync: bool):
+        kind = "full" if full_sync else "stock and price"
+        with self._status_lock:
+            self._status.is_running = True
+            self._status.last_run_started_at = datetime.now()
+            self._status.last_run_full_sync = full_sync
+        logger.info(f"Starting a scheduled {kind} synchronization.")
+
+        error = None
+        try:
+            self._run_sync(full_sync)
+        except Exception as exception:
+            error = repr(exception)
+            logger.exception(f"Scheduled {kind} synchronization failed.")
+
+        with self._status_lock:
+            self._status.is_running = False
+            self._status.runs_number += 1
+            self._status.last_run_finished_at = datetime.now()
+            self._status.last_run_error = error
+            if error is None:
+                self._status.last_success_at = (
+                    self._status.last_run_finished_at)
+            else:
+                self._status.failures_number += 1
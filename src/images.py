@@ -1,11 +1,22 @@
+import hashlib
+import pickle
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Callable, Sequence
+from typing import Callable, Iterable, Sequence
 
 import dropbox
 from dropbox.exceptions import ApiError
+from dropbox.files import (
+    CommitInfo, UploadSessionCursor, UploadSessionFinishArg, WriteMode)
 from loguru import logger
 
 from src.entities import Product, ProductWithImage
+from src.metrics import metrics
+
+
+def normalize_image_key(key: str) -> str:
+    return " ".join(key.split()).casefold()
 
 
 class ImagesFolder:
@@ -14,14 +25,36 @@ class ImagesFolder:
             folder_path: Path | str,
             products: Sequence[Product],
             default_image_name: str,
-            match: Callable[[Product, str], bool]
+            match: Callable[[Product, str], bool] | None = None,
+            key: Callable[[Product], str] | None = None,
+            normalize_key: Callable[[str], str] = normalize_image_key,
+            warn_about_unused_images: bool = True
     ):
+        if (match is None) == (key is None):
+            raise ValueError("Exactly one of match and key must be passed.")
+
         self._folder_path = Path(folder_path)
         self._products = products
         self._default_image_path = self._folder_path / default_image_name
         self._match = match
+        self._key = key
+        self._normalize_key = normalize_key
         self._images = []
+        self._folder_mtime_ns = None
+
+        self.refresh()
+        if warn_about_unused_images:
+            self.warn_about_unused_images(self._products)
+
+    def refresh(self) -> bool:
+        # Adding, removing or renaming an image changes the modification
+        # time of the folder, so an unchanged folder is not scanned again.
+        folder_mtime_ns = self._folder_path.stat().st_mtime_ns
+        if folder_mtime_ns == self._folder_mtime_ns:
+            return False
+        self._folder_mtime_ns = folder_mtime_ns
 
+        self._images = []
         for path in self._folder_path.iterdir():
             if path.is_file() and path.suffix.lower() in [".jpg", ".png"]:
                 self._images.append(path)
@@ -31,28 +64,127 @@ class ImagesFolder:
                                f"images is not a file or it is not JPG or PNG "
                                f"format.")
 
-        for image in self._images:
-            matched_products = list(filter(
-                lambda product: self._match(product, image.stem),
-                self._products
-            ))
-            if len(matched_products) == 0:
-                logger.warning(f"Image file {image.name} is not used.")
+        if self._key is not None:
+            self._images_index = self._get_images_index()
+        return True
 
     def get_products_with_images(self) -> Sequence[ProductWithImage]:
         products_with_images = []
         for product in self._products:
-            product_with_image = self._get_product_with_image(product)
+            product_with_image = self.get_product_with_image(product)
             products_with_images.append(product_with_image)
 
         return products_with_images
 
-    def _get_product_with_image(self, product: Product) -> ProductWithImage:
+    def get_product_with_image(self, product: Product) -> ProductWithImage:
+        if self._key is not None:
+            images = self._images_index.get(
+                self._normalize_key(self._key(product)))
+            if images:
+                return ProductWithImage(product, images[0])
+            return ProductWithImage(product, self._default_image_path)
+
         for image in self._images:
             if self._match(product, image.stem):
                 return ProductWithImage(product, image)
         return ProductWithImage(product, self._default_image_path)
 
+    def warn_about_unused_images(self, products: Iterable[Product]):
+        if self._key is not None:
+            self._warn_about_unused_indexed_images(products)
+        else:
+            self._warn_about_unused_images(products)
+
+    def _get_images_index(self) -> dict[str, list[Path]]:
+        images_index = defaultdict(list)
+        for image in sorted(self._images):
+            images_index[self._normalize_key(image.stem)].append(image)
+        return images_index
+
+    def _warn_about_unused_indexed_images(self, products: Iterable[Product]):
+        product_keys = {
+            self._normalize_key(self._key(product)) for product in products}
+        for image_key in sorted(self._images_index.keys() - product_keys):
+            for image in self._images_index[image_key]:
+                logger.warning(f"Image file {image.name} is not used.")
+
+    def _warn_about_unused_images(self, products: Iterable[Product]):
+        products = list(products)
+        for image in self._images:
+            matched_products = list(filter(
+                lambda product: self._match(product, image.stem),
+                products
+            ))
+            if len(matched_products) == 0:
+                logger.warning(f"Image file {image.name} is not used.")
+
+
+class DropboxImagesUploadError(RuntimeError):
+    pass
+
+
+class DropboxImagesCache:
+    def __init__(self, filepath: Path | str):
+        self._filepath = Path(filepath)
+        self._content_hashes: dict[str, tuple[int, int, str]] = {}
+        self._images: dict[str, tuple[str, str]] = {}
+
+    def load(self):
+        if not self._filepath.is_file():
+            return
+        with self._filepath.open(mode="rb") as file:
+            self._content_hashes, self._images = pickle.load(file)
+
+    def dump(self):
+        temporary_filepath = self._filepath.with_name(
+            self._filepath.name + ".tmp")
+        with temporary_filepath.open(mode="wb") as file:
+            pickle.dump((self._content_hashes, self._images), file)
+        temporary_filepath.replace(self._filepath)
+
+    def get_content_hash(self, path: Path) -> str:
+        stat = path.stat()
+        cached_content_hash = self._content_hashes.get(str(path))
+        if (cached_content_hash is not None and
+                cached_content_hash[:2] == (stat.st_mtime_ns, stat.st_size)):
+            return cached_content_hash[2]
+
+        content_hash = hashlib.sha256()
+        with path.open(mode="rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                content_hash.update(chunk)
+
+        hexdigest = content_hash.hexdigest()
+        self._content_hashes[str(path)] = (
+            stat.st_mtime_ns, stat.st_size, hexdigest)
+        return hexdigest
+
+    def get_image(self, content_hash: str) -> tuple[str, str] | None:
+        return self._images.get(content_hash)
+
+    def set_image(self, content_hash: str, dropbox_image_path: str, url: str):
+        self._images[content_hash] = (dropbox_image_path, url)
+
+    def remove_image(self, content_hash: str):
+        self._images.pop(content_hash, None)
+
+    def get_unreferenced_images(
+            self, content_hashes: Iterable[str]) -> dict[str, str]:
+        referenced_content_hashes = set(content_hashes)
+        return {
+            content_hash: dropbox_image_path
+            for content_hash, (dropbox_image_path, _) in self._images.items()
+            if content_hash not in referenced_content_hashes
+        }
+
+    def forget_files_except(self, paths: Iterable[Path]):
+        kept_paths = {str(path) for path in paths}
+        self._content_hashes = {
+            path: content_hash
+            for path, content_hash in self._content_hashes.items()
+            if path in kept_paths
+        }
+
 
 class DropboxImages:
     def __init__(
@@ -62,30 +194,76 @@ class DropboxImages:
             app_secret: str,
             dropbox_folder_path: str,
             products_with_images: Sequence[ProductWithImage],
-            default_image_path: Path | str
+            default_image_path: Path | str,
+            max_workers: int = 1,
+            chunk_size: int = 4 * 1024 * 1024,
+            batch_size: int = 1000,
+            max_retries_on_rate_limit: int = 10,
+            cache: DropboxImagesCache | None = None,
+            list_shared_links: bool = False
     ):
-        self._dropbox = dropbox.Dropbox(
+        self._dropbox = metrics.instrument(dropbox.Dropbox(
             oauth2_refresh_token=refresh_token,
             app_key=app_key,
-            app_secret=app_secret
-        )
+            app_secret=app_secret,
+            max_retries_on_rate_limit=max_retries_on_rate_limit
+        ), "dropbox")
         self._dropbox_folder_path = dropbox_folder_path
         self._products_with_images = products_with_images
+        self._max_workers = max_workers
+        self._chunk_size = chunk_size
+        self._batch_size = batch_size
+        self._cache = cache
+        self._list_shared_links = list_shared_links
+        self._shared_link_urls: dict[str, str] | None = None
         self._uploaded_images = []
         self._default_image_path = Path(default_image_path)
-        self._default_image_url = self._upload_image(self._default_image_path)
+        self._image_urls: dict[Path, str] = {}
+        self._requested_images_count = 0
+        self._saved_uploads_count = 0
+
+    @property
+    def requested_images_count(self) -> int:
+        return self._requested_images_count
+
+    @property
+    def saved_uploads_count(self) -> int:
+        return self._saved_uploads_count
+
+    def reset(self):
+        # Prepares a long-lived instance for the next synchronization. The
+        # URLs are keyed by local paths whose images may change in between,
+        # while the cache and the shared links stay valid.
+        self._image_urls.clear()
+        self._uploaded_images.clear()
+        self._requested_images_count = 0
+        self._saved_uploads_count = 0
 
     def get_products_with_image_urls(self) -> Sequence[Product]:
+        products = self.set_image_urls(self._products_with_images)
+
+        logger.info(f"Image URLs were requested for "
+                    f"{self._requested_images_count} products, "
+                    f"{self._saved_uploads_count} uploads were saved by "
+                    f"sharing identical images.")
+
+        return products
+
+    def set_image_urls(
+            self, products_with_images: Sequence[ProductWithImage]
+    ) -> list[Product]:
+        image_urls = self._get_image_urls([
+            product_with_image.image_path or self._default_image_path
+            for product_with_image in products_with_images
+        ])
+
         products = []
-        for product_with_image in self._products_with_images:
+        for product_with_image in products_with_images:
             product = product_with_image.product
-            image_path = product_with_image.image_path
+            image_path = product_with_image.image_path or (
+                self._default_image_path)
 
-            if (image_path == self._default_image_path and
-                    product.image_url is not None):
-                product.image_url = self._default_image_url
-            else:
-                product.image_url = self._upload_image(image_path)
+            product.image_url = image_urls[image_path]
 
             products.append(product)
 
@@ -96,17 +274,179 @@ class DropboxImages:
             self._delete_image(uploaded_image)
         self._uploaded_images.clear()
 
-    def _upload_image(self, path: Path) -> str:
-        dropbox_image_path = f"{self._dropbox_folder_path}/{path.name}"
-        logger.info(f"Uploading the file {dropbox_image_path} to Dropbox.")
-        image_bytes = path.read_bytes()
-        self._dropbox.files_upload(image_bytes, dropbox_image_path)
-        self._uploaded_images.append(dropbox_image_path)
-        logger.info(f"File {dropbox_image_path} was successfully uploaded to "
-                    f"Dropbox.")
-        return self._get_direct_shared_link_url(dropbox_image_path)
+    def evict_unreferenced_images(self, image_paths: Iterable[Path]):
+        image_paths = set(image_paths) | {self._default_image_path}
+        content_hashes = [
+            self._cache.get_content_hash(path) for path in image_paths]
+        unreferenced_images = self._cache.get_unreferenced_images(
+            content_hashes)
+
+        for content_hash, dropbox_image_path in unreferenced_images.items():
+            self._delete_image(dropbox_image_path)
+            self._cache.remove_image(content_hash)
+        self._cache.forget_files_except(image_paths)
+
+        logger.info(f"{len(unreferenced_images)} unreferenced images were "
+                    f"evicted from Dropbox.")
+
+    def _get_image_urls(self, image_paths: Sequence[Path]) -> dict[Path, str]:
+        paths_to_upload = sorted(set(image_paths) - self._image_urls.keys())
+        self._image_urls.update(self._upload_images(paths_to_upload))
+
+        self._requested_images_count += len(image_paths)
+        self._saved_uploads_count += len(image_paths) - len(paths_to_upload)
+        return self._image_urls
+
+    def _upload_images(self, paths: Sequence[Path]) -> dict[Path, str]:
+        if self._cache is None:
+            return self._upload_new_images(paths)
+
+        content_hashes = {
+            path: self._cache.get_content_hash(path) for path in paths}
+
+        paths_to_upload = {}
+        for path, content_hash in content_hashes.items():
+            if self._cache.get_image(content_hash) is None:
+                paths_to_upload.setdefault(content_hash, path)
+
+        logger.info(f"{len(paths) - len(paths_to_upload)} images were found "
+                    f"in the cache of Dropbox images, {len(paths_to_upload)} "
+                    f"images have to be uploaded.")
+
+        uploaded_image_urls = self._upload_new_images(
+            list(paths_to_upload.values()))
+        for content_hash, path in paths_to_upload.items():
+            if path in uploaded_image_urls:
+                self._cache.set_image(
+                    content_hash, self._get_dropbox_image_path(path),
+                    uploaded_image_urls[path])
+
+        image_urls = {}
+        for path, content_hash in content_hashes.items():
+            cached_image = self._cache.get_image(content_hash)
+            if cached_image is not None:
+                image_urls[path] = cached_image[1]
+        return image_urls
+
+    def _upload_new_images(self, paths: Sequence[Path]) -> dict[Path, str]:
+        dropbox_image_paths = {}
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for batch_start in range(0, len(paths), self._batch_size):
+                batch = paths[batch_start:batch_start + self._batch_size]
+                dropbox_image_paths.update(
+                    self._upload_images_batch(executor, batch))
+
+            if self._list_shared_links and self._shared_link_urls is None:
+                self._shared_link_urls = self._get_shared_link_urls()
+
+            urls = executor.map(
+                self._get_direct_shared_link_url,
+                dropbox_image_paths.values())
+            return dict(zip(dropbox_image_paths.keys(), urls))
+
+    def _upload_images_batch(
+            self, executor: ThreadPoolExecutor, paths: Sequence[Path]
+    ) -> dict[Path, str]:
+        cursors = executor.map(self._upload_image_session, paths)
+        dropbox_image_paths = [
+            self._get_dropbox_image_path(path) for path in paths]
+        # Content-addressed paths always hold the same bytes, so a leftover
+        # file from a lost cache can be safely overwritten.
+        write_mode = WriteMode.add
+        if self._cache is not None:
+            write_mode = WriteMode.overwrite
+        entries = [
+            UploadSessionFinishArg(
+                cursor, CommitInfo(dropbox_image_path, mode=write_mode))
+            for cursor, dropbox_image_path in zip(
+                cursors, dropbox_image_paths)
+        ]
+
+        logger.info(f"Committing {len(entries)} uploaded files to Dropbox.")
+        result = self._dropbox.files_upload_session_finish_batch_v2(entries)
+
+        uploaded_images = {}
+        failed_dropbox_image_paths = []
+        for path, dropbox_image_path, entry in zip(
+                paths, dropbox_image_paths, result.entries):
+            if entry.is_failure():
+                logger.error(f"Failed to upload the file "
+                             f"{dropbox_image_path} to Dropbox: "
+                             f"{entry.get_failure()}")
+                failed_dropbox_image_paths.append(dropbox_image_path)
+                continue
+            self._uploaded_images.append(dropbox_image_path)
+            uploaded_images[path] = dropbox_image_path
+            logger.info(f"File {dropbox_image_path} was successfully "
+                        f"uploaded to Dropbox.")
+
+        # Products must not be saved to the state with an image that was
+        # not uploaded, otherwise the upload is never retried.
+        if failed_dropbox_image_paths:
+            raise DropboxImagesUploadError(
+                f"{len(failed_dropbox_image_paths)} files were not uploaded "
+                f"to Dropbox: {', '.join(failed_dropbox_image_paths)}")
+        return uploaded_images
+
+    def _get_dropbox_image_path(self, path: Path) -> str:
+        if self._cache is None:
+            return f"{self._dropbox_folder_path}/{path.name}"
+        content_hash = self._cache.get_content_hash(path)
+        return (f"{self._dropbox_folder_path}/"
+                f"{content_hash}{path.suffix.lower()}")
+
+    def _upload_image_session(self, path: Path) -> UploadSessionCursor:
+        logger.info(f"Uploading the file {path} to Dropbox.")
+        with path.open(mode="rb") as file:
+            chunk = file.read(self._chunk_size)
+            is_last_chunk = len(chunk) < self._chunk_size
+            session = self._dropbox.files_upload_session_start(
+                chunk, close=is_last_chunk)
+            cursor = UploadSessionCursor(session.session_id, len(chunk))
+
+            while not is_last_chunk:
+                chunk = file.read(self._chunk_size)
+                is_last_chunk = len(chunk) < self._chunk_size
+                self._dropbox.files_upload_session_append_v2(
+                    chunk, cursor, close=is_last_chunk)
+                cursor.offset += len(chunk)
+
+        metrics.increment("dropbox_uploaded_bytes", cursor.offset)
+        metrics.increment("dropbox_uploaded_files")
+        return cursor
+
+    def _get_shared_link_urls(self) -> dict[str, str]:
+        logger.info(f"Listing existing shared links for "
+                    f"{self._dropbox_folder_path}")
+        folder_path_prefix = self._dropbox_folder_path.lower() + "/"
+
+        shared_link_urls = {}
+        result = self._dropbox.sharing_list_shared_links()
+        while True:
+            for link in result.links:
+                path = link.path_lower
+                if path is not None and path.startswith(folder_path_prefix):
+                    shared_link_urls[path] = link.url
+            if not result.has_more:
+                break
+            result = self._dropbox.sharing_list_shared_links(
+                cursor=result.cursor)
+
+        logger.info(f"{len(shared_link_urls)} existing shared links were "
+                    f"found for {self._dropbox_folder_path}")
+        return shared_link_urls
 
     def _get_direct_shared_link_url(self, dropbox_image_path: str) -> str:
+        url = None
+        if self._shared_link_urls is not None:
+            url = self._shared_link_urls.get(dropbox_image_path.lower())
+        if url is None:
+            url = self._create_shared_link_url(dropbox_image_path)
+        direct_url = url.replace(
+            "www.dropbox.com", "dl.dropboxusercontent.com")
+        return direct_url
+
+    def _create_shared_link_url(self, dropbox_image_path: str) -> str:
         try:
             logger.info(f"Trying to create shared link for "
                         f"{dropbox_image_path}")
@@ -121,12 +461,12 @@ class DropboxImages:
                 dropbox_image_path, direct_only=True).links[0].url
             logger.info(f"Shared link for {dropbox_image_path} was "
                         f"successfully retrieved.")
-        direct_url = url.replace(
-            "www.dropbox.com", "dl.dropboxusercontent.com")
-        return direct_url
+        return url
 
     def _delete_image(self, dropbox_image_path: str):
         logger.info(f"Deleting the file {dropbox_image_path} from Dropbox.")
         self._dropbox.files_delete(dropbox_image_path)
+        if self._shared_link_urls is not None:
+            self._shared_link_urls.pop(dropbox_image_path.lower(), None)
         logger.info(f"File {dropbox_image_path} was successfully deleted from "
                     f"Dropbox.")
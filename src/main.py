@@ -1,20 +1,49 @@
+import argparse
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import Sequence
+from typing import Iterable, Iterator, Self, Sequence
 
 from loguru import logger
 
 from src.config import settings
-from src.entities import Folder, Product
-from src.images import DropboxImages, ImagesFolder
-from src.odata_1c import OData1CClient, OData1CMapper
-from src.state import State
-from src.tilda import TildaCsvFileManager, TildaSeleniumCsvFileUploader
+from src.daemon import FileLock, SyncDaemon, SyncLockedError
+from src.entities import Folder, Product, ProductWithImage
+from src.images import DropboxImages, DropboxImagesCache, ImagesFolder
+from src.metrics import metrics, run_profiled
+from src.odata_1c import (
+    OData1CClient, OData1CEntities, OData1CMapper, OData1CResponseCache,
+    OData1CSnapshot)
+from src.pipeline import Pipeline, StageStatistics
+from src.state import CHANGED, VOLATILE_CHANGED, SqliteState, State
+from src.tilda import (
+    DESCRIPTION_COLUMN, EXTERNAL_ID_COLUMN, OLD_PRICE_COLUMN, PRICE_COLUMN,
+    QUANTITY_COLUMN, SKU_COLUMN, TildaCsvFileManager,
+    TildaHttpCsvFileUploader, TildaImportError, TildaSeleniumCsvFileUploader)
 
 logger.add(
     settings.logfile, format="{time} {level} {message}", level="INFO",
     rotation="10 MB"
 )
 
+NOMENCLATURE_ENTITY = "Catalog_Номенклатура"
+STOCK_ENTITY = "AccumulationRegister_ОстаткиТоваровКомпании/Balance()"
+STOCK_RECORDS_ENTITY = "AccumulationRegister_ОстаткиТоваровКомпании_RecordType"
+PRICE_ENTITY = "InformationRegister_Цены_RecordType/SliceLast()"
+PRICE_RECORDS_ENTITY = "InformationRegister_Цены_RecordType"
+VOLATILE_PRODUCT_FIELDS = ["description", "price", "old_price", "quantity"]
+VOLATILE_COLUMNS = [
+    SKU_COLUMN, DESCRIPTION_COLUMN, PRICE_COLUMN, QUANTITY_COLUMN,
+    OLD_PRICE_COLUMN, EXTERNAL_ID_COLUMN
+]
+REMOVED_COLUMNS = [QUANTITY_COLUMN, EXTERNAL_ID_COLUMN]
+PRODUCT_FIELDS = [
+    "Ref_Key", "Parent_Key", "IsFolder", "Description", "DataVersion",
+    "НаименованиеПолное", "Артикул"
+]
+
 
 def get_product_brand(folders: Sequence[Folder]) -> str:
     for folder in folders:
@@ -23,167 +52,802 @@ def get_product_brand(folders: Sequence[Folder]) -> str:
     return ""
 
 
-def get_product_price(product: dict) -> int | None:
+def is_part_folder_path(folders: Sequence[Folder]) -> bool:
+    folder_names = [folder.name for folder in folders]
+
+    is_part = "Запасные части" in folder_names
+    is_foton = "FOTON" in folder_names
+    is_ashok = "ASHOK" in folder_names
+
+    return is_part and (is_foton or is_ashok)
+
+
+def get_retail_price(
+        product: dict, retail_price_types: dict[str, bool]) -> int | None:
+    # Whether a price type is the retail one is resolved once per type key
+    # instead of once per price of every product.
     for price_option in product["Цены"]:
-        if price_option["ТипЦены"][0]["Description"] == "Розничная цена":
+        price_type_key = price_option["ТипЦен_Key"]
+        is_retail = retail_price_types.get(price_type_key)
+        if is_retail is None:
+            is_retail = (price_option["ТипЦены"][0]["Description"]
+                         == "Розничная цена")
+            retail_price_types[price_type_key] = is_retail
+        if is_retail:
             return int(price_option["Цена"])
 
 
-def get_product_quantity(product: dict) -> int:
-    if product["Остаток"]:
-        return int(product["Остаток"][0]["КоличествоBalance"])
-    return 0
+def map_products_batch(
+        products: Sequence[dict], folders: Sequence[Folder],
+        retail_price_types: dict[str, bool]
+) -> list[Product | None]:
+    if not is_part_folder_path(folders):
+        return [None] * len(products)
+
+    brand = get_product_brand(folders)
+    categories = ["Запчасти/Каталог", f"Запчасти/{brand}"]
+    mapped_products: list[Product | None] = []
+    for product in products:
+        sku = product["Артикул"]
+        if not sku:
+            mapped_products.append(None)
+            continue
+
+        stock = product["Остаток"]
+        if stock and int(stock[0]["КоличествоBalance"]) != 0:
+            description = "В наличии"
+        else:
+            description = "На заказ"
+
+        title = product["НаименованиеПолное"].replace(",", ", ")
+        mapped_products.append(Product(
+            external_id=product["Ref_Key"],
+            title=f"{title} [арт. {sku}]",
+            sku=sku,
+            brand=brand,
+            description=description,
+            price=get_retail_price(product, retail_price_types),
+            categories=list(categories)
+        ))
+    return mapped_products
 
 
 def map_single_product(
         product: dict, folders: Sequence[Folder]) -> Product | None:
-    sku = product["Артикул"]
-    if not sku:
-        return
-
-    folder_names = [folder.name for folder in folders]
+    return map_products_batch([product], folders, {})[0]
 
-    is_part = "Запасные части" in folder_names
-    is_foton = "FOTON" in folder_names
-    is_ashok = "ASHOK" in folder_names
 
-    if not (is_part and (is_foton or is_ashok)):
+def get_retail_price_filter_expression(
+        price_type_entities: OData1CEntities) -> str | None:
+    conditions = [
+        f"ТипЦен_Key eq guid'{price_type['Ref_Key']}'"
+        for price_type in price_type_entities.entities
+    ]
+    if not conditions:
         return
-
-    quantity = get_product_quantity(product)
-    description = "В наличии"
-    if quantity == 0:
-        description = "На заказ"
-
-    title = product["НаименованиеПолное"].replace(",", ", ")
-    title = f"{title} [арт. {sku}]"
-
-    return Product(
-        external_id=product["Ref_Key"],
-        title=title,
-        sku=sku,
-        brand=get_product_brand(folders),
-        description=description,
-        price=get_product_price(product),
-        categories=[
-            "Запчасти/Каталог", f"Запчасти/{get_product_brand(folders)}"]
+    return " or ".join(conditions)
+
+
+def get_register_entities(
+        odata_client: OData1CClient, entity_name: str,
+        product_keys: Iterable[str] | None, **query
+) -> OData1CEntities:
+    # Only a few dozen keys fit in one filter, so the registers of all the
+    # products are requested unfiltered when product_keys is None.
+    if product_keys is None:
+        return odata_client.get_entities(entity_name=entity_name, **query)
+    return odata_client.get_entities_by_keys(
+        entity_name=entity_name,
+        key_field="Номенклатура_Key",
+        keys=product_keys,
+        **query
     )
 
 
-def get_products_from_1c() -> Sequence[Product]:
-    odata_client = OData1CClient(
-        settings.odata_url, settings.odata_username, settings.odata_password)
-
-    product_entities = odata_client.get_entities(
-        entity_name="Catalog_Номенклатура",
-        select=[
-            "Ref_Key", "Parent_Key", "IsFolder", "Description",
-            "НаименованиеПолное", "Артикул"
-        ]
+def get_stock_entities(
+        odata_client: OData1CClient, product_keys: Iterable[str] | None
+) -> OData1CEntities:
+    return get_register_entities(
+        odata_client, STOCK_ENTITY, product_keys,
+        select=["Номенклатура_Key", "КоличествоBalance"],
+        page_size=settings.odata_page_size,
+        order_by=["Номенклатура_Key"]
     )
 
-    stock_entities = odata_client.get_entities(
-        entity_name="AccumulationRegister_ОстаткиТоваровКомпании/Balance()",
-        select=["Номенклатура_Key", "КоличествоBalance"]
-    )
 
-    price_entities = odata_client.get_entities(
-        entity_name="InformationRegister_Цены_RecordType/SliceLast()",
-        select=["Номенклатура_Key", "ТипЦен_Key", "Цена"]
+def get_price_entities(
+        odata_client: OData1CClient, product_keys: Iterable[str] | None,
+        retail_price_filter_expression: str | None
+) -> OData1CEntities:
+    if retail_price_filter_expression is None:
+        return OData1CEntities([])
+    return get_register_entities(
+        odata_client, PRICE_ENTITY, product_keys,
+        select=["Номенклатура_Key", "ТипЦен_Key", "Цена"],
+        filter_expression=retail_price_filter_expression,
+        page_size=settings.odata_page_size,
+        order_by=["Номенклатура_Key", "ТипЦен_Key"]
     )
 
-    price_type_entities = odata_client.get_entities(
-        entity_name="Catalog_ТипыЦен", select=["Ref_Key", "Description"]
-    )
 
-    prices_extended_with_types = price_entities.expand_with(
+def filter_register_entities(
+        entities: OData1CEntities, product_keys: set[str]
+) -> OData1CEntities:
+    return OData1CEntities([
+        entity for entity in entities.entities
+        if entity["Номенклатура_Key"] in product_keys
+    ])
+
+
+def get_part_entities(
+        odata_client: OData1CClient, part_folder_keys: Iterable[str],
+        retail_price_filter_expression: str | None
+) -> tuple[OData1CEntities, OData1CEntities, OData1CEntities]:
+    product_entities = odata_client.get_entities_by_keys(
+        entity_name=NOMENCLATURE_ENTITY,
+        key_field="Parent_Key",
+        keys=part_folder_keys,
+        select=PRODUCT_FIELDS,
+        filter_expression="IsFolder eq false",
+        page_size=settings.odata_page_size,
+        order_by=["Ref_Key"]
+    )
+    product_keys = {
+        product["Ref_Key"] for product in product_entities.entities}
+
+    # A full load needs the registers of most of the products, so they are
+    # fetched whole and joined locally instead of by thousands of key
+    # filtered requests.
+    stock_entities = filter_register_entities(
+        get_stock_entities(odata_client, None), product_keys)
+    price_entities = filter_register_entities(
+        get_price_entities(
+            odata_client, None, retail_price_filter_expression),
+        product_keys)
+
+    return product_entities, stock_entities, price_entities
+
+
+def get_last_register_period(
+        odata_client: OData1CClient, entity_name: str) -> str | None:
+    records = odata_client.get_entities(
+        entity_name=entity_name,
+        select=["Period"],
+        order_by=["Period desc"],
+        top=1
+    )
+    if records.entities:
+        return records.entities[0]["Period"]
+
+
+def get_changed_register_keys(
+        odata_client: OData1CClient, entity_name: str, period: str | None,
+        product_keys: Iterable[str]
+) -> tuple[set[str], str | None]:
+    if period is None:
+        return (set(product_keys),
+                get_last_register_period(odata_client, entity_name))
+
+    records = odata_client.get_entities(
+        entity_name=entity_name,
+        select=["Номенклатура_Key", "Period"],
+        filter_expression=f"Period ge datetime'{period}'",
+        page_size=settings.odata_page_size,
+        order_by=["Period", "Номенклатура_Key"]
+    )
+    changed_keys = {record["Номенклатура_Key"] for record in records.entities}
+    last_period = max(
+        (record["Period"] for record in records.entities), default=period)
+    return changed_keys, last_period
+
+
+def load_snapshot(
+        odata_client: OData1CClient, snapshot: OData1CSnapshot,
+        part_folder_keys: Iterable[str],
+        retail_price_filter_expression: str | None
+):
+    # Register periods are taken before the data itself, so records made
+    # during the loading are picked up by the next synchronization.
+    stock_period = get_last_register_period(
+        odata_client, STOCK_RECORDS_ENTITY)
+    price_period = get_last_register_period(
+        odata_client, PRICE_RECORDS_ENTITY)
+
+    product_entities, stock_entities, price_entities = get_part_entities(
+        odata_client, part_folder_keys, retail_price_filter_expression)
+
+    snapshot.replace(NOMENCLATURE_ENTITY, "Ref_Key", product_entities)
+    snapshot.replace(STOCK_ENTITY, "Номенклатура_Key", stock_entities)
+    snapshot.replace(PRICE_ENTITY, "Номенклатура_Key", price_entities)
+    snapshot.set_period(STOCK_RECORDS_ENTITY, stock_period)
+    snapshot.set_period(PRICE_RECORDS_ENTITY, price_period)
+
+    logger.info(f"The snapshot was fully loaded with "
+                f"{len(product_entities.entities)} products.")
+
+
+def sync_snapshot(
+        odata_client: OData1CClient, snapshot: OData1CSnapshot,
+        part_folder_keys: Iterable[str],
+        retail_price_filter_expression: str | None
+):
+    product_versions = odata_client.get_entities_by_keys(
+        entity_name=NOMENCLATURE_ENTITY,
+        key_field="Parent_Key",
+        keys=part_folder_keys,
+        select=["Ref_Key", "DataVersion"],
+        filter_expression="IsFolder eq false",
+        page_size=settings.odata_page_size,
+        order_by=["Ref_Key"]
+    )
+    versions = {
+        product["Ref_Key"]: product["DataVersion"]
+        for product in product_versions.entities
+    }
+    cached_versions = {
+        product["Ref_Key"]: product["DataVersion"]
+        for product in snapshot.get_entities(NOMENCLATURE_ENTITY).entities
+    }
+
+    changed_keys = {
+        key for key, version in versions.items()
+        if cached_versions.get(key) != version
+    }
+    removed_keys = cached_versions.keys() - versions.keys()
+
+    changed_product_entities = odata_client.get_entities_by_keys(
+        entity_name=NOMENCLATURE_ENTITY,
+        key_field="Ref_Key",
+        keys=changed_keys,
+        select=PRODUCT_FIELDS
+    )
+    snapshot.update(
+        NOMENCLATURE_ENTITY, "Ref_Key", changed_keys,
+        changed_product_entities)
+    for entity_name in (NOMENCLATURE_ENTITY, STOCK_ENTITY, PRICE_ENTITY):
+        snapshot.remove(entity_name, removed_keys)
+
+    stock_keys, stock_period = get_changed_register_keys(
+        odata_client, STOCK_RECORDS_ENTITY,
+        snapshot.get_period(STOCK_RECORDS_ENTITY), versions)
+    price_keys, price_period = get_changed_register_keys(
+        odata_client, PRICE_RECORDS_ENTITY,
+        snapshot.get_period(PRICE_RECORDS_ENTITY), versions)
+
+    stock_keys = (stock_keys | changed_keys) & versions.keys()
+    price_keys = (price_keys | changed_keys) & versions.keys()
+
+    snapshot.update(
+        STOCK_ENTITY, "Номенклатура_Key", stock_keys,
+        get_stock_entities(odata_client, stock_keys))
+    snapshot.update(
+        PRICE_ENTITY, "Номенклатура_Key", price_keys,
+        get_price_entities(
+            odata_client, price_keys, retail_price_filter_expression))
+    snapshot.set_period(STOCK_RECORDS_ENTITY, stock_period)
+    snapshot.set_period(PRICE_RECORDS_ENTITY, price_period)
+
+    logger.info(f"The snapshot was synchronized: {len(changed_keys)} "
+                f"products changed, {len(removed_keys)} products removed, "
+                f"{len(stock_keys | price_keys)} products with updated "
+                f"stock or prices.")
+
+
+def get_odata_cache() -> OData1CResponseCache | None:
+    if settings.odata_cache_directory is None:
+        if settings.odata_offline:
+            raise ValueError("The offline mode requires the OData cache "
+                             "directory to be set.")
+        return None
+
+    odata_cache = OData1CResponseCache(
+        settings.odata_cache_directory,
+        max_age=settings.odata_cache_max_age,
+        offline=settings.odata_offline)
+    odata_cache.prune(settings.odata_cache_retention)
+    return odata_cache
+
+
+def create_odata_client() -> OData1CClient:
+    return OData1CClient(
+        settings.odata_url, settings.odata_username, settings.odata_password,
+        timeout=settings.odata_timeout, retries=settings.odata_retries,
+        max_filter_length=settings.odata_max_filter_length,
+        compact_entities=settings.odata_compact_entities,
+        cache=get_odata_cache())
+
+
+def create_odata_snapshot() -> OData1CSnapshot | None:
+    if settings.odata_snapshot_file is None:
+        return None
+    return OData1CSnapshot(settings.odata_snapshot_file)
+
+
+def get_catalog_entities_from_1c(
+        full_sync: bool = False, odata_client: OData1CClient | None = None,
+        snapshot: OData1CSnapshot | None = None
+) -> OData1CEntities:
+    # A passed client and snapshot are kept open and in memory for the
+    # next calls, otherwise they only live for this call.
+    if odata_client is None:
+        odata_client_context = create_odata_client()
+        snapshot = create_odata_snapshot()
+    else:
+        odata_client_context = nullcontext(odata_client)
+
+    with odata_client_context as odata_client:
+        folder_entities, price_type_entities = odata_client.get_many([
+            dict(
+                entity_name=NOMENCLATURE_ENTITY,
+                select=["Ref_Key", "Parent_Key", "IsFolder", "Description"],
+                filter_expression="IsFolder eq true",
+                page_size=settings.odata_page_size,
+                order_by=["Ref_Key"]
+            ),
+            dict(
+                entity_name="Catalog_ТипыЦен",
+                select=["Ref_Key", "Description"],
+                filter_expression="Description eq 'Розничная цена'"
+            )
+        ])
+
+        folder_paths = OData1CMapper(
+            folder_entities, map_single_product).get_folder_paths()
+        part_folder_keys = [
+            folder_key for folder_key, folders in folder_paths.items()
+            if is_part_folder_path(folders)
+        ]
+        retail_price_filter_expression = get_retail_price_filter_expression(
+            price_type_entities)
+
+        if snapshot is None:
+            product_entities, stock_entities, price_entities = (
+                get_part_entities(
+                    odata_client, part_folder_keys,
+                    retail_price_filter_expression))
+        else:
+            if not full_sync and (snapshot.is_loaded or snapshot.load()):
+                # Offline runs replay the snapshot as it is, because the
+                # changes since its last period cannot be requested.
+                if not settings.odata_offline:
+                    sync_snapshot(
+                        odata_client, snapshot, part_folder_keys,
+                        retail_price_filter_expression)
+            else:
+                load_snapshot(
+                    odata_client, snapshot, part_folder_keys,
+                    retail_price_filter_expression)
+            snapshot.dump()
+
+            product_entities = snapshot.get_entities(NOMENCLATURE_ENTITY)
+            stock_entities = snapshot.get_entities(STOCK_ENTITY)
+            price_entities = snapshot.get_entities(PRICE_ENTITY)
+
+    prices_extended_with_types = price_entities.expand_on(
         price_type_entities,
-        expand_condition=lambda price, price_type:
-            price["ТипЦен_Key"] == price_type["Ref_Key"],
+        left_key="ТипЦен_Key",
+        right_key="Ref_Key",
         key="ТипЦены"
     )
 
-    extended_product_entities = product_entities.expand_with(
+    extended_product_entities = product_entities.expand_on(
         prices_extended_with_types,
-        expand_condition=lambda product, price:
-            product["Ref_Key"] == price["Номенклатура_Key"],
+        left_key="Ref_Key",
+        right_key="Номенклатура_Key",
         key="Цены"
-    ).expand_with(
+    ).expand_on(
         stock_entities,
-        expand_condition=lambda product, stock:
-            product["Ref_Key"] == stock["Номенклатура_Key"],
+        left_key="Ref_Key",
+        right_key="Номенклатура_Key",
         key="Остаток"
     )
+    return OData1CEntities(
+        folder_entities.entities + extended_product_entities.entities)
+
 
+def iter_products_from_1c(
+        full_sync: bool = False, odata_client: OData1CClient | None = None,
+        snapshot: OData1CSnapshot | None = None
+) -> Iterator[Product]:
     mapped_products = OData1CMapper(
-        extended_product_entities, map_single_product).map_products()
+        get_catalog_entities_from_1c(full_sync, odata_client, snapshot),
+        map_single_product,
+        single_pass=True,
+        map_products_batch=partial(map_products_batch, retail_price_types={})
+    ).iter_products()
+
+    products_number = 0
+    for product in mapped_products:
+        if products_number == settings.max_products_number:
+            logger.warning(f"Exceeded the maximum number of products in the "
+                           f"Tilda. The number of products was limited to "
+                           f"{settings.max_products_number}")
+            break
+        products_number += 1
+        yield product
 
     logger.info(f"Successfully received information about "
-                f"{len(mapped_products)} products using OData.")
+                f"{products_number} products using OData.")
 
-    if len(mapped_products) > settings.max_products_number:
-        logger.warning(f"Exceeded the maximum number of products in the Tilda. "
-                       f"The number of products was limited to "
-                       f"{settings.max_products_number}")
 
-    return mapped_products[:settings.max_products_number]
+def get_products_from_1c(full_sync: bool = False) -> Sequence[Product]:
+    return list(iter_products_from_1c(full_sync))
 
 
-def upload_products_to_tilda(products: Sequence[Product]):
+def create_tilda_csv_files(
+        filename_format: str, products: Sequence[Product],
+        columns: Sequence[str] | None = None
+) -> Sequence[Path]:
     if len(products) == 0:
-        logger.info("Uploading files to the Tilde is skipped because the "
-                    "number of products is zero")
-        return
+        return []
 
     file_manager = TildaCsvFileManager(
         settings.csv_files_directory,
-        filename_format="import_{datetime}.csv",
-        products=products
+        filename_format=filename_format,
+        products=products,
+        max_rows_per_file=settings.csv_max_rows_per_file,
+        max_file_size=settings.csv_max_file_size,
+        columns=columns
     )
-    file_manager.create_file()
-
-    file_uploader = TildaSeleniumCsvFileUploader(
-        file_manager.filepath,
+    file_manager.create_files()
+    return file_manager.filepaths
+
+
+def create_tilda_file_uploader(
+) -> TildaHttpCsvFileUploader | TildaSeleniumCsvFileUploader:
+    if settings.tilda_uploader == "http":
+        logger.warning("The http Tilda uploader is experimental, its "
+                       "endpoints were not verified against Tilda.")
+        return TildaHttpCsvFileUploader(
+            None,
+            settings.tilda_email,
+            settings.tilda_password,
+            settings.tilda_project_id,
+            settings.selenium_timeout,
+            settings.selenium_file_uploading_timeout
+        )
+    return TildaSeleniumCsvFileUploader(
+        None,
         settings.tilda_email,
         settings.tilda_password,
         settings.tilda_project_id,
         settings.selenium_timeout,
-        settings.selenium_file_uploading_timeout
+        settings.selenium_file_uploading_timeout,
+        user_data_dir=settings.selenium_user_data_dir,
+        cookies_file=settings.tilda_cookies_file
     )
-    file_uploader.upload_file()
+
+
+def login_to_tilda(
+) -> TildaHttpCsvFileUploader | TildaSeleniumCsvFileUploader:
+    file_uploader = create_tilda_file_uploader()
+    try:
+        file_uploader.login()
+    except BaseException:
+        file_uploader.close()
+        raise
+    return file_uploader
+
+
+def close_tilda_file_uploader(file_uploader: Future):
+    if file_uploader.exception() is None:
+        file_uploader.result().close()
+
+
+def upload_products_to_tilda(
+        file_uploader: TildaHttpCsvFileUploader | TildaSeleniumCsvFileUploader,
+        products: Sequence[Product],
+        volatile_changed_products: Sequence[Product] = (),
+        removed_external_ids: Sequence[str] = ()
+):
+    removed_products = [
+        Product(external_id=external_id, title="", quantity=0)
+        for external_id in removed_external_ids
+    ]
+
+    filepaths = [
+        *create_tilda_csv_files("import_{datetime}_{part}.csv", products),
+        *create_tilda_csv_files(
+            "import_prices_{datetime}_{part}.csv", volatile_changed_products,
+            columns=VOLATILE_COLUMNS),
+        *create_tilda_csv_files(
+            "import_removed_{datetime}_{part}.csv", removed_products,
+            columns=REMOVED_COLUMNS)
+    ]
+
+    if len(filepaths) == 0:
+        logger.info("Uploading files to the Tilde is skipped because the "
+                    "number of products is zero")
+        return
+
+    results = file_uploader.upload_files(filepaths)
+    # The state must not record the products of the files Tilda did not
+    # import, so a failed login or import fails the synchronization.
+    imported_filepaths = {
+        result.filepath for result in results if result.status == "done"}
+    not_imported_filepaths = [
+        filepath for filepath in filepaths
+        if filepath not in imported_filepaths
+    ]
+    if not_imported_filepaths:
+        raise TildaImportError(
+            f"{len(not_imported_filepaths)} of {len(filepaths)} csv files "
+            f"were not imported to the Tilda: "
+            f"{', '.join(path.name for path in not_imported_filepaths)}.")
+
+
+def create_state() -> State | SqliteState:
+    if settings.state_database_file is None:
+        return State(settings.state_file)
+    return SqliteState(
+        settings.state_database_file,
+        key=lambda item: item.product.external_id,
+        volatile_fields=VOLATILE_PRODUCT_FIELDS)
+
+
+class SyncContext:
+    # Everything that can outlive a single synchronization. The daemon
+    # keeps one context between its runs, so the sessions, the images
+    # index and the caches stay warm.
+    def __init__(self):
+        self.state = create_state()
+        self.images_folder = ImagesFolder(
+            settings.images_folder,
+            [],
+            settings.default_image,
+            key=lambda product: product.sku,
+            warn_about_unused_images=False
+        )
+
+        self.dropbox_images_cache = None
+        if settings.dropbox_cache_file is not None:
+            self.dropbox_images_cache = DropboxImagesCache(
+                settings.dropbox_cache_file)
+            self.dropbox_images_cache.load()
+
+        self.dropbox_images = DropboxImages(
+            settings.dropbox_refresh_token,
+            settings.dropbox_app_key,
+            settings.dropbox_app_secret,
+            "/Запчасти",
+            [],
+            Path(settings.images_folder) / settings.default_image,
+            max_workers=settings.dropbox_max_workers,
+            cache=self.dropbox_images_cache,
+            list_shared_links=True
+        )
+
+        self.odata_client = create_odata_client()
+        self.odata_snapshot = create_odata_snapshot()
+        self._login_executor = ThreadPoolExecutor(max_workers=1)
+        self._file_uploader: Future | None = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_file_uploader(self) -> Future:
+        # Logging in runs concurrently with the pipeline, and the logged in
+        # uploader is reused by the next synchronizations.
+        if self._file_uploader is None:
+            self._file_uploader = self._login_executor.submit(login_to_tilda)
+        return self._file_uploader
+
+    def close_file_uploader(self):
+        if self._file_uploader is not None:
+            close_tilda_file_uploader(self._file_uploader)
+            self._file_uploader = None
+
+    def close(self):
+        self.close_file_uploader()
+        self._login_executor.shutdown()
+        self.odata_client.close()
+        if isinstance(self.state, SqliteState):
+            self.state.close()
+
+
+def log_pipeline_statistics(statistics: Iterable[StageStatistics]):
+    for stage_statistics in statistics:
+        metrics.observe(
+            "pipeline_stage", stage_statistics.busy_seconds,
+            stage=stage_statistics.name)
+        metrics.increment(
+            "pipeline_stage_items", stage_statistics.items_number,
+            stage=stage_statistics.name)
+        logger.info(f"Stage {stage_statistics.name} processed "
+                    f"{stage_statistics.items_number} items in "
+                    f"{stage_statistics.busy_seconds:.2f} s "
+                    f"({stage_statistics.throughput:.1f} items/s).")
+
+
+def dump_metrics():
+    if settings.metrics_report_file is not None:
+        metrics.dump_json(settings.metrics_report_file)
+        logger.info(f"Run report was written to "
+                    f"{settings.metrics_report_file}.")
+    if settings.metrics_prometheus_file is not None:
+        metrics.dump_prometheus(settings.metrics_prometheus_file)
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Synchronize products from 1C with the Tilda store.")
+    parser.add_argument(
+        "--profile", nargs="?", const="sync.prof", metavar="FILE",
+        help="run under cProfile and dump the statistics to FILE "
+             "(sync.prof by default)")
+    parser.add_argument(
+        "--offline", action="store_true",
+        help="replay OData responses from the cache without contacting 1C")
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="keep running and synchronize on the configured intervals")
+    return parser.parse_args()
+
+
+def run(full_sync: bool = False, context: SyncContext | None = None):
+    metrics.reset()
+    try:
+        with metrics.time("sync", full_sync=str(full_sync).lower()):
+            sync(full_sync, context)
+    except Exception:
+        metrics.increment("sync_failures")
+        raise
+    finally:
+        dump_metrics()
 
 
 @logger.catch
 def main():
-    products = get_products_from_1c()
+    if settings.sync_lock_file is None:
+        run()
+        return
+    try:
+        with FileLock(settings.sync_lock_file):
+            run()
+    except SyncLockedError as exception:
+        logger.error(f"Synchronization was not started. {exception}")
 
-    images_folder = ImagesFolder(
-        settings.images_folder,
-        products,
-        settings.default_image,
-        match=lambda product, image_name: product.sku == image_name,
-    )
-    products_with_images = images_folder.get_products_with_images()
-
-    state = State(settings.state_file)
-    products_with_images_to_update = state.filter_not_presented(
-        products_with_images)
-
-    dropbox_images = DropboxImages(
-        settings.dropbox_refresh_token,
-        settings.dropbox_app_key,
-        settings.dropbox_app_secret,
-        "/Запчасти",
-        products_with_images_to_update,
-        Path(settings.images_folder) / settings.default_image
+
+@logger.catch
+def run_daemon():
+    with SyncContext() as context:
+        SyncDaemon(
+            lambda full_sync: run(full_sync, context),
+            refresh_interval=settings.daemon_refresh_interval,
+            full_sync_interval=settings.daemon_full_sync_interval,
+            lock_file=settings.sync_lock_file,
+            health_port=settings.daemon_health_port,
+            get_metrics=metrics.render_prometheus
+        ).run()
+
+
+def sync(full_sync: bool = False, context: SyncContext | None = None):
+    if context is None:
+        with SyncContext() as context:
+            sync(full_sync, context)
+        return
+
+    state = context.state
+    is_differential_export = (
+        settings.tilda_differential_export and isinstance(state, SqliteState))
+    classify_change = state.get_change_classifier()
+
+    images_folder = context.images_folder
+    images_folder.refresh()
+    dropbox_images_cache = context.dropbox_images_cache
+    dropbox_images = context.dropbox_images
+    dropbox_images.reset()
+
+    products_with_images = []
+
+    def get_product_with_image(product: Product) -> ProductWithImage:
+        product_with_image = images_folder.get_product_with_image(product)
+        products_with_images.append(product_with_image)
+        return product_with_image
+
+    def classify_product_with_image(
+            product_with_image: ProductWithImage
+    ) -> tuple[ProductWithImage, str] | None:
+        change = classify_change(product_with_image)
+        if change is None:
+            return None
+        # Logging in starts with the first change and runs concurrently
+        # with the rest of the pipeline. Runs without changes never start
+        # a browser.
+        context.get_file_uploader()
+        if not is_differential_export:
+            change = CHANGED
+        return product_with_image, change
+
+    def set_image_urls(
+            changes: list[tuple[ProductWithImage, str]]
+    ) -> list[tuple[ProductWithImage, str]]:
+        dropbox_images.set_image_urls([
+            product_with_image for product_with_image, change in changes
+            if change != VOLATILE_CHANGED
+        ])
+        return changes
+
+    pipeline = Pipeline(settings.pipeline_queue_size).set_source(
+        "odata", iter_products_from_1c(
+            full_sync, context.odata_client, context.odata_snapshot)
+    ).add_stage(
+        "images", get_product_with_image
+    ).add_stage(
+        "state", classify_product_with_image
+    ).add_batch_stage(
+        "dropbox", set_image_urls, settings.pipeline_batch_size
     )
-    products_with_image_urls = dropbox_images.get_products_with_image_urls()
 
-    upload_products_to_tilda(products_with_image_urls)
+    try:
+        changes = pipeline.run()
+        log_pipeline_statistics(pipeline.statistics)
+        logger.info(f"Image URLs were requested for "
+                    f"{dropbox_images.requested_images_count} products, "
+                    f"{dropbox_images.saved_uploads_count} uploads were "
+                    f"saved by sharing identical images.")
+
+        images_folder.warn_about_unused_images(
+            product_with_image.product
+            for product_with_image in products_with_images
+        )
+        removed_external_ids = []
+        if is_differential_export:
+            removed_external_ids = state.get_removed_keys(
+                products_with_images)
+
+        if changes or removed_external_ids:
+            started_at = time.perf_counter()
+            with metrics.time("tilda_upload"):
+                upload_products_to_tilda(
+                    context.get_file_uploader().result(),
+                    [
+                        product_with_image.product
+                        for product_with_image, change in changes
+                        if change != VOLATILE_CHANGED
+                    ],
+                    [
+                        product_with_image.product
+                        for product_with_image, change in changes
+                        if change == VOLATILE_CHANGED
+                    ],
+                    removed_external_ids
+                )
+            logger.info(f"Stage tilda took "
+                        f"{time.perf_counter() - started_at:.2f} s.")
+        else:
+            logger.info("Uploading files to the Tilda is skipped because "
+                        "no products were changed or removed.")
+    except BaseException:
+        # The session may be the reason of the failure, so the next
+        # synchronization logs in again.
+        context.close_file_uploader()
+        raise
 
     state.dump(products_with_images)
-    dropbox_images.delete_uploaded_images()
+
+    if dropbox_images_cache is None:
+        dropbox_images.delete_uploaded_images()
+    else:
+        dropbox_images.evict_unreferenced_images(
+            product_with_image.image_path
+            for product_with_image in products_with_images
+        )
+        dropbox_images_cache.dump()
 
 
 if __name__ == '__main__':
-    main()
+    arguments = parse_arguments()
+    if arguments.offline:
+        settings.odata_offline = True
+    if arguments.daemon:
+        run_daemon()
+    elif arguments.profile is None:
+        main()
+    else:
+        run_profiled(main, arguments.profile)
+        logger.info(f"Profiling statistics were written to "
+                    f"{arguments.profile}.")
@@ -0,0 +1,215 @@
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+MetricKey = tuple[str, tuple[tuple[str, str], ...]]
+
+
+@dataclass(slots=True)
+class TimerStatistics:
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class Metrics:
+    def __init__(self, prefix: str = "autocube"):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: dict[MetricKey, float] = {}
+        self._timers: dict[MetricKey, TimerStatistics] = {}
+        self._started_at = datetime.now()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self._started_at = datetime.now()
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        key = self._get_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        key = self._get_key(name, labels)
+        with self._lock:
+            timer = self._timers.setdefault(key, TimerStatistics())
+            timer.count += 1
+            timer.total_seconds += seconds
+            timer.max_seconds = max(timer.max_seconds, seconds)
+
+    @contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def timed(self, name: str, **labels: str) -> Callable:
+        def decorator(function: Callable) -> Callable:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def iter_timed(
+            self, name: str, items: Iterable[T], **labels: str
+    ) -> Iterator[T]:
+        iterator = iter(items)
+        busy_seconds = 0.0
+        items_number = 0
+        try:
+            while True:
+                started_at = time.perf_counter()
+                try:
+                    item = next(iterator)
+                finally:
+                    busy_seconds += time.perf_counter() - started_at
+                items_number += 1
+                yield item
+        except StopIteration:
+            pass
+        finally:
+            self.observe(name, busy_seconds, **labels)
+            self.increment(f"{name}_items", items_number, **labels)
+
+    def instrument(self, client: Any, name: str) -> Any:
+        return _InstrumentedClient(self, client, name)
+
+    def get_report(self) -> dict:
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            timers = [
+                {"name": name, "labels": dict(labels), **asdict(timer)}
+                for (name, labels), timer in sorted(self._timers.items())
+            ]
+        return {
+            "started_at": self._started_at.isoformat(),
+            "finished_at": datetime.now().isoformat(),
+            "counters": counters,
+            "timers": timers
+        }
+
+    def dump_json(self, filepath: Path | str):
+        self._write(filepath, json.dumps(
+            self.get_report(), ensure_ascii=False, indent=2))
+
+    def dump_prometheus(self, filepath: Path | str):
+        self._write(filepath, self.render_prometheus())
+
+    def render_prometheus(self) -> str:
+        report = self.get_report()
+        lines = []
+        counter_names = {counter["name"] for counter in report["counters"]}
+        for name in sorted(counter_names):
+            metric_name = f"{self._prefix}_{name}_total"
+            lines.append(f"# TYPE {metric_name} counter")
+            for counter in report["counters"]:
+                if counter["name"] == name:
+                    lines.append(
+                        f"{metric_name}{self._render_labels(counter)} "
+                        f"{counter['value']}")
+
+        for name in sorted({timer["name"] for timer in report["timers"]}):
+            metric_name = f"{self._prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric_name} summary")
+            for timer in report["timers"]:
+                if timer["name"] == name:
+                    labels = self._render_labels(timer)
+                    lines.append(
+                        f"{metric_name}_sum{labels} {timer['total_seconds']}")
+                    lines.append(
+                        f"{metric_name}_count{labels} {timer['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _get_key(name: str, labels: dict[str, str]) -> MetricKey:
+        return name, tuple(sorted(
+            (label, str(value)) for label, value in labels.items()))
+
+    @staticmethod
+    def _render_labels(metric: dict) -> str:
+        if not metric["labels"]:
+            return ""
+        labels = ",".join(
+            f'{label}="{json.dumps(value, ensure_ascii=False)[1:-1]}"'
+            for label, value in metric["labels"].items()
+        )
+        return f"{{{labels}}}"
+
+    @staticmethod
+    def _write(filepath: Path | str, content: str):
+        filepath = Path(filepath)
+        temporary_filepath = filepath.with_name(filepath.name + ".tmp")
+        temporary_filepath.write_text(content, encoding="utf-8")
+        temporary_filepath.replace(filepath)
+
+
+class _InstrumentedClient:
+    def __init__(self, metrics: Metrics, client: Any, name: str):
+        self._metrics = metrics
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, attribute_name: str) -> Any:
+        attribute = getattr(self._client, attribute_name)
+        if not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        def wrapper(*args, **kwargs):
+            with self._metrics.time(
+                    f"{self._name}_call", method=attribute_name):
+                try:
+                    return attribute(*args, **kwargs)
+                except Exception:
+                    self._metrics.increment(
+                        f"{self._name}_errors", method=attribute_name)
+                    raise
+        return wrapper
+
+
+def run_profiled(function: Callable[[], T], filepath: Path | str) -> T:
+    # cProfile only follows the thread it was enabled in, so every thread
+    # started during the run gets its own profiler and the results are
+    # merged at the end.
+    profilers = [cProfile.Profile()]
+    profilers_lock = threading.Lock()
+
+    def enable_thread_profiler(*args):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with profilers_lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    threading.setprofile(enable_thread_profiler)
+    try:
+        return profilers[0].runcall(function)
+    finally:
+        threading.setprofile(None)
+        with profilers_lock:
+            stats = pstats.Stats(*profilers)
+        stats.dump_stats(filepath)
+
+
+metrics = Metrics()
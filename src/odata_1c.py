@@ -1,11 +1,103 @@
+import codecs
+import gzip
+import hashlib
+import json
+import pickle
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from typing import Callable, Iterable, Self, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Self, Sequence
+from urllib.parse import quote
 
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util import Retry
 
 from src.entities import Folder, Product
+from src.metrics import metrics
+
+
+class OData1CRecordSchema:
+    __slots__ = ("indexes", "_extensions")
+
+    def __init__(self, fields: Iterable[str]):
+        self.indexes = {
+            sys.intern(field): index for index, field in enumerate(fields)}
+        self._extensions: dict[str, OData1CRecordSchema] = {}
+
+    def extend(self, field: str) -> "OData1CRecordSchema":
+        extension = self._extensions.get(field)
+        if extension is None:
+            extension = OData1CRecordSchema(
+                [*(name for name in self.indexes if name != field), field])
+            self._extensions[field] = extension
+        return extension
+
+
+class OData1CRecord(Mapping):
+    # A read-only entity that keeps its values in a list and shares the
+    # field names with all the entities of the same shape.
+    __slots__ = ("_schema", "_values")
+
+    def __init__(self, schema: OData1CRecordSchema, values: tuple):
+        self._schema = schema
+        self._values = values
+
+    def __getitem__(self, field: str):
+        return self._values[self._schema.indexes[field]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._schema.indexes)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f"OData1CRecord({dict(self)!r})"
+
+    def extend(self, field: str, value) -> "OData1CRecord":
+        schema = self._schema.extend(field)
+        values = [self.get(name) for name in schema.indexes]
+        values[-1] = value
+        return OData1CRecord(schema, tuple(values))
+
+
+class OData1CRecordFactory:
+    def __init__(self):
+        self._schemas: dict[tuple[str, ...], OData1CRecordSchema] = {}
+        self._guids: dict[str, str] = {}
+
+    def create(self, entity: dict) -> OData1CRecord:
+        fields = tuple(entity)
+        schema = self._schemas.get(fields)
+        if schema is None:
+            schema = self._schemas.setdefault(
+                fields, OData1CRecordSchema(fields))
+        return OData1CRecord(
+            schema, tuple(self._compact(value) for value in entity.values()))
+
+    def _compact(self, value):
+        # Keys of the same catalog item are repeated in every register, so
+        # equal GUIDs are stored once.
+        if isinstance(value, str) and len(value) == 36 and (
+                value[8] == value[13] == value[18] == value[23] == "-"):
+            return self._guids.setdefault(value, value)
+        return value
+
+
+def extend_entity(entity: Mapping, field: str, value) -> Mapping:
+    if isinstance(entity, OData1CRecord):
+        return entity.extend(field, value)
+    extended_entity = dict(entity)
+    extended_entity[field] = value
+    return extended_entity
 
 
 class OData1CEntities:
@@ -16,6 +108,7 @@ class OData1CEntities:
     def entities(self):
         return self._entities
 
+    @metrics.timed("odata_expand")
     def expand_with(
             self,
             other_response: Self,
@@ -23,51 +116,499 @@ class OData1CEntities:
             key: str
     ) -> Self:
         entity_should_be_expanded = expand_condition
-        expanded_entities = deepcopy(self._entities)
+        expanded_entities = []
+
+        for entity in deepcopy(self._entities):
+            other_entities = [
+                other_entity for other_entity in other_response._entities
+                if entity_should_be_expanded(entity, other_entity)
+            ]
+            expanded_entities.append(
+                extend_entity(entity, key, other_entities))
 
-        for entity in expanded_entities:
-            entity[key] = []
+        return OData1CEntities(expanded_entities)
+
+    @metrics.timed("odata_expand")
+    def expand_on(
+            self,
+            other_response: Self,
+            left_key: str,
+            right_key: str,
+            key: str
+    ) -> Self:
+        other_entities_index = defaultdict(list)
+        for other_entity in other_response._entities:
+            other_entities_index[other_entity[right_key]].append(other_entity)
 
-            for other_entity in other_response._entities:
-                if entity_should_be_expanded(entity, other_entity):
-                    entity[key].append(other_entity)
+        expanded_entities = []
+        for entity in self._entities:
+            expanded_entities.append(extend_entity(
+                entity, key,
+                list(other_entities_index.get(entity[left_key], ()))))
 
         return OData1CEntities(expanded_entities)
 
 
+class ODataJsonStream:
+    def __init__(
+            self, chunks: Iterable[str], array_field: str = "value",
+            record_factory: OData1CRecordFactory | None = None
+    ):
+        self._chunks = iter(chunks)
+        self._array_field = array_field
+        self._record_factory = record_factory
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+
+    def __iter__(self) -> Iterator[dict]:
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            field = self._decode()
+            self._expect(":")
+            if field == self._array_field:
+                yield from self._iter_array()
+                return
+            self._decode()
+            if self._expect(",", "}") == "}":
+                return
+
+    def _iter_array(self) -> Iterator[dict]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._position += 1
+            return
+        while True:
+            value = self._decode()
+            if self._record_factory is not None and isinstance(value, dict):
+                value = self._record_factory.create(value)
+            yield value
+            if self._expect(",", "]") == "]":
+                return
+
+    def _peek(self) -> str:
+        while True:
+            while (self._position < len(self._buffer) and
+                   self._buffer[self._position] in " \t\n\r"):
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read_chunk():
+                raise ValueError("Unexpected end of the OData JSON stream")
+
+    def _expect(self, *chars: str) -> str:
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"Unexpected character {char!r} in the OData "
+                             f"JSON stream, expected one of {chars}")
+        self._position += 1
+        return char
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(
+                    self._buffer, self._position)
+            except json.JSONDecodeError:
+                if not self._read_chunk():
+                    raise
+                continue
+            # A value ending exactly at the end of the buffer may be a
+            # truncated number or literal, so it is decoded once more.
+            if end == len(self._buffer) and self._read_chunk():
+                continue
+            self._position = end
+            return value
+
+    def _read_chunk(self) -> bool:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+
+class OData1CCacheMissError(LookupError):
+    pass
+
+
+@dataclass(slots=True)
+class OData1CCacheEntry:
+    created_at: float
+    etag: str | None
+    content_hash: str
+    entities: list[dict]
+
+
+class OData1CResponseCache:
+    # Each query is stored in its own gzipped pickle. The modification
+    # time of the file is the moment the entry was last validated.
+    def __init__(
+            self, directory: Path | str, max_age: float | None = None,
+            offline: bool = False, compress_level: int = 6
+    ):
+        self._directory = Path(directory)
+        self._max_age = max_age
+        self._offline = offline
+        self._compress_level = compress_level
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def offline(self) -> bool:
+        return self._offline
+
+    @staticmethod
+    def get_key(**query) -> str:
+        data = json.dumps(
+            {
+                name: list(value)
+                if value is not None and not isinstance(value, (str, int))
+                else value
+                for name, value in query.items()
+            },
+            ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def load(self, key: str) -> OData1CCacheEntry | None:
+        path = self._get_path(key)
+        if not path.is_file():
+            return None
+        try:
+            with gzip.open(path, mode="rb") as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError) as error:
+            logger.warning(f"The OData cache file {path.name} is damaged "
+                           f"and is ignored: {error}")
+            return None
+
+    def is_fresh(self, key: str) -> bool:
+        if self._max_age is None:
+            return False
+        path = self._get_path(key)
+        return (path.is_file() and
+                time.time() - path.stat().st_mtime <= self._max_age)
+
+    def store(
+            self, key: str, entities: list[dict], etag: str | None,
+            previous_entry: OData1CCacheEntry | None = None
+    ):
+        content_hash = hashlib.blake2b(
+            pickle.dumps(entities, pickle.HIGHEST_PROTOCOL),
+            digest_size=16).hexdigest()
+        if previous_entry is not None and (
+                previous_entry.content_hash == content_hash and
+                previous_entry.etag == etag):
+            self.touch(key)
+            return
+
+        path = self._get_path(key)
+        temporary_path = path.with_name(path.name + ".tmp")
+        with gzip.open(
+                temporary_path, mode="wb",
+                compresslevel=self._compress_level) as file:
+            pickle.dump(
+                OData1CCacheEntry(time.time(), etag, content_hash, entities),
+                file, pickle.HIGHEST_PROTOCOL)
+        temporary_path.replace(path)
+
+    def touch(self, key: str):
+        self._get_path(key).touch()
+
+    def prune(self, max_age: float):
+        removed_number = 0
+        for path in self._directory.glob("*.pickle.gz"):
+            if time.time() - path.stat().st_mtime > max_age:
+                path.unlink(missing_ok=True)
+                removed_number += 1
+        if removed_number:
+            logger.info(f"{removed_number} outdated entries were removed "
+                        f"from the OData cache.")
+
+    def _get_path(self, key: str) -> Path:
+        return self._directory / f"{key}.pickle.gz"
+
+
 class OData1CClient:
-    def __init__(self, odata_url: str, username: str, password: str):
+    def __init__(
+            self, odata_url: str, username: str, password: str,
+            chunk_size: int = 64 * 1024,
+            timeout: float | None = None,
+            retries: int = 3,
+            backoff_factor: float = 1,
+            pool_size: int = 10,
+            max_filter_length: int = 2000,
+            compact_entities: bool = False,
+            cache: OData1CResponseCache | None = None
+    ):
         if not odata_url.endswith("/"):
             odata_url += "/"
         self._odata_url = odata_url
-        self._auth = HTTPBasicAuth(
+        self._chunk_size = chunk_size
+        self._timeout = timeout
+        self._pool_size = pool_size
+        self._max_filter_length = max_filter_length
+        self._cache = cache
+        self._record_factory = None
+        if compact_entities:
+            self._record_factory = OData1CRecordFactory()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET"]
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry, pool_connections=pool_size,
+            pool_maxsize=pool_size)
+
+        self._session = requests.Session()
+        self._session.auth = HTTPBasicAuth(
             username.encode("utf-8"), password.encode("utf-8"))
+        self._session.headers["Accept-Encoding"] = "gzip, deflate"
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._session.close()
+
+    def get_many(
+            self, queries: Sequence[dict], max_workers: int | None = None
+    ) -> list[OData1CEntities | None]:
+        if max_workers is None:
+            max_workers = max(min(len(queries), self._pool_size), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self.get_entities, **query)
+                for query in queries
+            ]
+            return [future.result() for future in futures]
+
+    def get_entities_by_keys(
+            self, entity_name: str, key_field: str, keys: Iterable[str],
+            select: Iterable[str] | None = None,
+            filter_expression: str | None = None,
+            page_size: int | None = None,
+            order_by: Iterable[str] | None = None
+    ) -> OData1CEntities:
+        queries = [
+            dict(
+                entity_name=entity_name,
+                select=select,
+                filter_expression=keys_filter_expression,
+                page_size=page_size,
+                order_by=order_by
+            )
+            for keys_filter_expression in self._get_keys_filter_expressions(
+                key_field, keys, filter_expression)
+        ]
+
+        entities = []
+        for entities_batch in self.get_many(queries):
+            entities += entities_batch.entities
+        return OData1CEntities(entities)
 
     def get_entities(
-            self, entity_name: str, select: Iterable[str] | None = None
+            self, entity_name: str, select: Iterable[str] | None = None,
+            page_size: int | None = None,
+            order_by: Iterable[str] | None = None,
+            filter_expression: str | None = None,
+            top: int | None = None
     ) -> OData1CEntities | None:
         logger.info(f"Getting the entity {entity_name} using OData")
 
-        params = {"$format": "json"}
-        if select is not None:
-            params["$select"] = ",".join(select)
+        cache_key = None
+        cache_entry = None
+        if self._cache is not None:
+            cache_key = self._cache.get_key(
+                odata_url=self._odata_url, entity_name=entity_name,
+                select=select, page_size=page_size,
+                order_by=order_by, filter_expression=filter_expression,
+                top=top)
+            cache_entry = self._cache.load(cache_key)
+            if cache_entry is not None and (
+                    self._cache.offline or self._cache.is_fresh(cache_key)):
+                metrics.increment("odata_cache_hits", entity=entity_name)
+                logger.info(f"The entity {entity_name} was taken from the "
+                            f"OData cache")
+                return OData1CEntities(cache_entry.entities)
+            if self._cache.offline:
+                raise OData1CCacheMissError(
+                    f"The entity {entity_name} is not in the OData cache "
+                    f"and the client is offline.")
 
-        response = requests.get(
-            self._odata_url + entity_name, auth=self._auth, params=params)
+        etag = None if cache_entry is None else cache_entry.etag
+        with metrics.time("odata_get_entities", entity=entity_name):
+            entities, etag = self._download_entities(
+                entity_name, select, page_size, order_by, filter_expression,
+                top, etag)
 
-        try:
-            response.raise_for_status()
-        except requests.HTTPError as error:
-            logger.error(f"Failed to get the entity {entity_name} using OData")
-            raise error
+        if entities is None:
+            metrics.increment("odata_cache_revalidations", entity=entity_name)
+            logger.info(f"The entity {entity_name} was not modified, the "
+                        f"OData cache is reused")
+            self._cache.touch(cache_key)
+            return OData1CEntities(cache_entry.entities)
 
-        entities = response.json()["value"]
+        if self._cache is not None:
+            self._cache.store(cache_key, entities, etag, cache_entry)
 
         logger.info(f"The entity {entity_name} was successfully retrieved "
                     f"using OData")
 
         return OData1CEntities(entities)
 
+    def iter_entities(
+            self, entity_name: str, select: Iterable[str] | None = None,
+            page_size: int | None = None,
+            order_by: Iterable[str] | None = None,
+            filter_expression: str | None = None,
+            top: int | None = None
+    ) -> Iterator[dict]:
+        params = self._get_params(select, order_by, filter_expression, top)
+
+        if page_size is None or top is not None:
+            yield from self._iter_page(entity_name, params)
+            return
+        # Without an order 1C may return the records of a page in any
+        # order, so $skip would drop some records and repeat others.
+        if order_by is None:
+            raise ValueError(f"Paging the entity {entity_name} requires an "
+                             f"order.")
+
+        skip = 0
+        while True:
+            page_params = params | {"$top": page_size, "$skip": skip}
+            received = 0
+            for entity in self._iter_page(entity_name, page_params):
+                received += 1
+                yield entity
+            logger.info(f"Received {received} records of the entity "
+                        f"{entity_name} starting from {skip}")
+            if received < page_size:
+                return
+            skip += page_size
+
+    def _download_entities(
+            self, entity_name: str, select: Iterable[str] | None,
+            page_size: int | None, order_by: Iterable[str] | None,
+            filter_expression: str | None, top: int | None,
+            etag: str | None = None
+    ) -> tuple[list[dict] | None, str | None]:
+        # Only a response that fits in one page has an ETag of its own, so
+        # conditional requests are not used for paged entities.
+        if page_size is not None and top is None:
+            return list(self.iter_entities(
+                entity_name, select, page_size, order_by, filter_expression,
+                top)), None
+
+        params = self._get_params(select, order_by, filter_expression, top)
+        headers = None if etag is None else {"If-None-Match": etag}
+        response = self._request(entity_name, params, headers)
+        if response.status_code == 304:
+            response.close()
+            return None, etag
+        etag = response.headers.get("ETag")
+        return list(self._iter_response(entity_name, response)), etag
+
+    @staticmethod
+    def _get_params(
+            select: Iterable[str] | None, order_by: Iterable[str] | None,
+            filter_expression: str | None, top: int | None
+    ) -> dict:
+        params = {"$format": "json"}
+        if select is not None:
+            params["$select"] = ",".join(select)
+        if order_by is not None:
+            params["$orderby"] = ",".join(order_by)
+        if filter_expression is not None:
+            params["$filter"] = filter_expression
+        if top is not None:
+            params["$top"] = top
+        return params
+
+    def _get_keys_filter_expressions(
+            self, key_field: str, keys: Iterable[str],
+            filter_expression: str | None = None
+    ) -> Iterator[str]:
+        prefix = ""
+        if filter_expression is not None:
+            prefix = f"({filter_expression}) and "
+
+        conditions = []
+        length = len(quote(prefix)) + 2
+        for key in keys:
+            condition = f"{key_field} eq guid'{key}'"
+            condition_length = len(quote(condition)) + len(quote(" or "))
+            if conditions and (
+                    length + condition_length > self._max_filter_length):
+                yield f"{prefix}({' or '.join(conditions)})"
+                conditions = []
+                length = len(quote(prefix)) + 2
+            conditions.append(condition)
+            length += condition_length
+
+        if conditions:
+            yield f"{prefix}({' or '.join(conditions)})"
+
+    def _iter_page(self, entity_name: str, params: dict) -> Iterator[dict]:
+        yield from self._iter_response(
+            entity_name, self._request(entity_name, params))
+
+    def _request(
+            self, entity_name: str, params: dict,
+            headers: dict[str, str] | None = None
+    ) -> requests.Response:
+        response = self._session.get(
+            self._odata_url + entity_name, params=params, headers=headers,
+            stream=True, timeout=self._timeout)
+        metrics.observe(
+            "odata_response", response.elapsed.total_seconds(),
+            entity=entity_name)
+        return response
+
+    def _iter_response(
+            self, entity_name: str, response: requests.Response
+    ) -> Iterator[dict]:
+        with response:
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as error:
+                metrics.increment("odata_errors", entity=entity_name)
+                logger.error(f"Failed to get the entity {entity_name} "
+                             f"using OData")
+                raise error
+
+            chunks = codecs.iterdecode(
+                self._iter_counted_content(response, entity_name),
+                "utf-8-sig")
+            rows_number = 0
+            try:
+                for entity in ODataJsonStream(
+                        chunks, record_factory=self._record_factory):
+                    rows_number += 1
+                    yield entity
+            finally:
+                metrics.increment(
+                    "odata_rows", rows_number, entity=entity_name)
+
+    def _iter_counted_content(
+            self, response: requests.Response, entity_name: str
+    ) -> Iterator[bytes]:
+        for chunk in response.iter_content(chunk_size=self._chunk_size):
+            metrics.increment("odata_bytes", len(chunk), entity=entity_name)
+            yield chunk
+
 
 class OData1CMapper:
     def __init__(
@@ -79,18 +620,99 @@ class OData1CMapper:
             parent_key_field: str = "Parent_Key",
             is_folder_field: str = "IsFolder",
             folder_name_field: str = "Description",
-            null_parent_key: str = "00000000-0000-0000-0000-000000000000"
+            null_parent_key: str = "00000000-0000-0000-0000-000000000000",
+            single_pass: bool = False,
+            map_products_batch: Callable[
+                [Sequence[dict], Sequence[Folder]],
+                Sequence[Product | None]] | None = None
     ):
         self._products = entities.entities
         self._map_single_product = map_single_product
+        self._map_products_batch = map_products_batch
         self._key_field = key_field
         self._parent_key_field = parent_key_field
         self._is_folder_field = is_folder_field
         self._folder_name_field = folder_name_field
         self._null_parent_key = null_parent_key
+        self._single_pass = single_pass
 
     def map_products(self) -> Sequence[Product]:
-        return self._get_products_in_folder()
+        return list(self.iter_products())
+
+    def iter_products(self) -> Iterator[Product]:
+        return metrics.iter_timed(
+            "odata_map_products", self._iter_products())
+
+    def _iter_products(self) -> Iterator[Product]:
+        if not self._single_pass and self._map_products_batch is None:
+            yield from self._get_products_in_folder()
+            return
+
+        children_index = self._get_children_index()
+        root_items = children_index.get(self._null_parent_key, ())
+        stack: list[tuple[
+            Iterator[dict], tuple[Folder, ...],
+            Iterator[Product | None] | None
+        ]] = [(
+            iter(root_items), (), self._map_folder_products(root_items, ()))]
+
+        while stack:
+            items, parent_folders, mapped_products = stack[-1]
+            item = next(items, None)
+            if item is None:
+                stack.pop()
+                continue
+
+            if item[self._is_folder_field]:
+                folder = Folder(
+                    item[self._folder_name_field], len(parent_folders))
+                folders = parent_folders + (folder,)
+                children = children_index.get(item[self._key_field], ())
+                stack.append((
+                    iter(children), folders,
+                    self._map_folder_products(children, folders)))
+            elif mapped_products is not None:
+                product = next(mapped_products)
+                if product is not None:
+                    yield product
+            else:
+                yield from self._process_product(item, parent_folders)
+
+    def get_folder_paths(self) -> dict[str, tuple[Folder, ...]]:
+        children_index = self._get_children_index()
+        folder_paths = {}
+
+        stack = [(self._null_parent_key, ())]
+        while stack:
+            folder_key, parent_folders = stack.pop()
+            for item in children_index.get(folder_key, ()):
+                if not item[self._is_folder_field]:
+                    continue
+                folder = Folder(
+                    item[self._folder_name_field], len(parent_folders))
+                folder_path = parent_folders + (folder,)
+                folder_paths[item[self._key_field]] = folder_path
+                stack.append((item[self._key_field], folder_path))
+
+        return folder_paths
+
+    def _map_folder_products(
+            self, items: Sequence[dict], folders: tuple[Folder, ...]
+    ) -> Iterator[Product | None] | None:
+        # All the products of a folder are mapped at once, so that the
+        # folder dependent values are computed once per folder.
+        if self._map_products_batch is None:
+            return None
+        products = [item for item in items if not item[self._is_folder_field]]
+        if not products:
+            return iter(())
+        return iter(self._map_products_batch(products, folders))
+
+    def _get_children_index(self) -> dict[str, list[dict]]:
+        children_index = defaultdict(list)
+        for item in self._products:
+            children_index[item[self._parent_key_field]].append(item)
+        return children_index
 
     def _get_products_in_folder(
             self,
@@ -141,3 +763,74 @@ class OData1CMapper:
         if product is None:
             return []
         return [product]
+
+
+class OData1CSnapshot:
+    def __init__(self, filepath: Path | str):
+        self._filepath = Path(filepath)
+        self._entities: dict[str, dict[str, list[dict]]] = {}
+        self._periods: dict[str, str] = {}
+        self._is_loaded = False
+
+    @property
+    def is_loaded(self) -> bool:
+        # Whether the entities in memory are the ones stored in the file, so
+        # a long-running process can skip loading it again. Changes that
+        # were not dumped, e.g. after a failed synchronization, reset it.
+        return self._is_loaded
+
+    def load(self) -> bool:
+        if not self._filepath.is_file():
+            return False
+        with self._filepath.open(mode="rb") as file:
+            self._entities, self._periods = pickle.load(file)
+        self._is_loaded = True
+        return True
+
+    def dump(self):
+        temporary_filepath = self._filepath.with_name(
+            self._filepath.name + ".tmp")
+        with temporary_filepath.open(mode="wb") as file:
+            pickle.dump((self._entities, self._periods), file)
+        temporary_filepath.replace(self._filepath)
+        self._is_loaded = True
+
+    def get_entities(self, entity_name: str) -> OData1CEntities:
+        keyed_entities = self._entities.get(entity_name, {})
+        entities = []
+        for key in sorted(keyed_entities):
+            entities += keyed_entities[key]
+        return OData1CEntities(entities)
+
+    def get_keys(self, entity_name: str) -> set[str]:
+        return set(self._entities.get(entity_name, {}))
+
+    def update(
+            self, entity_name: str, key_field: str, keys: Iterable[str],
+            entities: OData1CEntities
+    ):
+        self.remove(entity_name, keys)
+        self._is_loaded = False
+        keyed_entities = self._entities.setdefault(entity_name, {})
+        for entity in entities.entities:
+            keyed_entities.setdefault(entity[key_field], []).append(entity)
+
+    def replace(
+            self, entity_name: str, key_field: str, entities: OData1CEntities
+    ):
+        self._entities[entity_name] = {}
+        self.update(entity_name, key_field, [], entities)
+
+    def remove(self, entity_name: str, keys: Iterable[str]):
+        self._is_loaded = False
+        keyed_entities = self._entities.get(entity_name, {})
+        for key in keys:
+            keyed_entities.pop(key, None)
+
+    def get_period(self, entity_name: str) -> str | None:
+        return self._periods.get(entity_name)
+
+    def set_period(self, entity_name: str, period: str | None):
+        if period is not None:
+            self._is_loaded = False
+            self._periods[entity_name] = period
@@ -0,0 +1,156 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Self, Sequence
+
+_END = object()
+
+
+@dataclass(slots=True)
+class StageStatistics:
+    name: str
+    items_number: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        if self.busy_seconds == 0:
+            return 0.0
+        return self.items_number / self.busy_seconds
+
+
+class Pipeline:
+    def __init__(self, queue_size: int = 1000):
+        self._queue_size = queue_size
+        self._source: tuple[str, Iterable] | None = None
+        self._stages: list[tuple[str, Callable, int | None]] = []
+        self._statistics: list[StageStatistics] = []
+        self._errors: list[BaseException] = []
+
+    @property
+    def statistics(self) -> Sequence[StageStatistics]:
+        return self._statistics
+
+    def set_source(self, name: str, items: Iterable) -> Self:
+        self._source = (name, items)
+        return self
+
+    def add_stage(self, name: str, function: Callable[[Any], Any]) -> Self:
+        self._stages.append((name, function, None))
+        return self
+
+    def add_batch_stage(
+            self, name: str, function: Callable[[list], Iterable],
+            batch_size: int
+    ) -> Self:
+        self._stages.append((name, function, batch_size))
+        return self
+
+    def run(self) -> list:
+        if self._source is None:
+            raise ValueError("Source of the pipeline is not set.")
+
+        source_name, items = self._source
+        self._statistics = [StageStatistics(source_name)] + [
+            StageStatistics(name) for name, _, _ in self._stages]
+        self._errors = []
+
+        queues = [
+            queue.Queue(maxsize=self._queue_size)
+            for _ in range(len(self._stages) + 1)
+        ]
+        threads = [threading.Thread(
+            target=self._run_source,
+            args=(items, queues[0], self._statistics[0]),
+            name=source_name, daemon=True)]
+        for index, (name, function, batch_size) in enumerate(self._stages):
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(function, batch_size, queues[index], queues[index + 1],
+                      self._statistics[index + 1]),
+                name=name, daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        results = []
+        while (item := queues[-1].get()) is not _END:
+            results.append(item)
+
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        return results
+
+    def _run_source(
+            self, items: Iterable, output_queue: queue.Queue,
+            statistics: StageStatistics
+    ):
+        try:
+            iterator = iter(items)
+            while not self._errors:
+                started_at = time.perf_counter()
+                item = next(iterator, _END)
+                statistics.busy_seconds += time.perf_counter() - started_at
+                if item is _END:
+                    break
+                statistics.items_number += 1
+                output_queue.put(item)
+        except BaseException as error:
+            self._errors.append(error)
+        finally:
+            output_queue.put(_END)
+
+    def _run_stage(
+            self, function: Callable, batch_size: int | None,
+            input_queue: queue.Queue, output_queue: queue.Queue,
+            statistics: StageStatistics
+    ):
+        try:
+            while (batch := self._get_batch(input_queue, batch_size)):
+                if self._errors:
+                    self._drain(input_queue)
+                    break
+
+                started_at = time.perf_counter()
+                if batch_size is None:
+                    results = [function(batch[0])]
+                else:
+                    results = list(function(batch))
+                statistics.busy_seconds += time.perf_counter() - started_at
+                statistics.items_number += len(batch)
+
+                for result in results:
+                    if result is not None:
+                        output_queue.put(result)
+        except BaseException as error:
+            self._errors.append(error)
+            self._drain(input_queue)
+        finally:
+            output_queue.put(_END)
+
+    @staticmethod
+    def _get_batch(input_queue: queue.Queue, batch_size: int | None) -> list:
+        item = input_queue.get()
+        if item is _END:
+            return []
+
+        batch = [item]
+        while batch_size is not None and len(batch) < batch_size:
+            try:
+                item = input_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _END:
+                input_queue.put(_END)
+                break
+            batch.append(item)
+        return batch
+
+    @staticmethod
+    def _drain(input_queue: queue.Queue):
+        while input_queue.get() is not _END:
+            pass
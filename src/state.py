@@ -1,19 +1,51 @@
+import hashlib
+import json
 import pickle
+import sqlite3
+from dataclasses import dataclass, field, fields, is_dataclass
 from pathlib import Path
-from typing import Sequence, TypeVar
+from typing import Callable, Generic, Iterable, Sequence, TypeVar
 
 from loguru import logger
 
 T = TypeVar('T')
 
+ADDED = "added"
+CHANGED = "changed"
+VOLATILE_CHANGED = "volatile_changed"
+
+
+def get_fingerprint(
+        item, excluded_fields: frozenset[str] = frozenset()) -> str:
+    data = json.dumps(
+        _get_compared_value(item, excluded_fields), ensure_ascii=False,
+        default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _get_compared_value(value, excluded_fields: frozenset[str]):
+    if is_dataclass(value):
+        return [
+            _get_compared_value(
+                getattr(value, item_field.name), excluded_fields)
+            for item_field in fields(value)
+            if item_field.compare and item_field.name not in excluded_fields
+        ]
+    if isinstance(value, (list, tuple)):
+        return [_get_compared_value(item, excluded_fields) for item in value]
+    return value
+
 
 class State:
     def __init__(self, filepath: Path | str):
         self._filepath = Path(filepath)
 
     def dump(self, products: Sequence[T]):
-        with self._filepath.open(mode="wb") as file:
+        temporary_filepath = self._filepath.with_name(
+            self._filepath.name + ".tmp")
+        with temporary_filepath.open(mode="wb") as file:
             pickle.dump(products, file)
+        temporary_filepath.replace(self._filepath)
 
     def load(self) -> Sequence[T]:
         if not self._filepath.is_file():
@@ -22,10 +54,159 @@ class State:
             return pickle.load(file)
 
     def filter_not_presented(self, items: Sequence[T]) -> Sequence[T]:
+        classify = self.get_change_classifier()
+        return [item for item in items if classify(item) is not None]
+
+    def get_change_classifier(self) -> Callable[[T], str | None]:
         state = self.load()
-        not_presented = []
+        return lambda item: None if item in state else CHANGED
+
+
+@dataclass(slots=True)
+class StateDiff(Generic[T]):
+    added: list[T] = field(default_factory=list)
+    changed: list[T] = field(default_factory=list)
+    volatile_changed: list[T] = field(default_factory=list)
+    removed_keys: list[str] = field(default_factory=list)
+
+
+class SqliteState:
+    def __init__(
+            self, filepath: Path | str, key: Callable[[T], str],
+            volatile_fields: Iterable[str] = ()
+    ):
+        self._filepath = Path(filepath)
+        self._key = key
+        self._volatile_fields = frozenset(volatile_fields)
+        self._connection = sqlite3.connect(self._filepath)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, "
+                "static_fingerprint TEXT)")
+            columns = {
+                column[1] for column in
+                self._connection.execute("PRAGMA table_info(state)")
+            }
+            if "static_fingerprint" not in columns:
+                self._connection.execute(
+                    "ALTER TABLE state ADD COLUMN static_fingerprint TEXT")
+
+    def close(self):
+        self._connection.close()
+
+    def load_fingerprints(self) -> dict[str, tuple[str, str | None]]:
+        return {
+            key: (fingerprint, static_fingerprint)
+            for key, fingerprint, static_fingerprint in
+            self._connection.execute(
+                "SELECT key, fingerprint, static_fingerprint FROM state")
+        }
+
+    def filter_not_presented(self, items: Sequence[T]) -> Sequence[T]:
+        classify = self.get_change_classifier()
+        return [item for item in items if classify(item) is not None]
+
+    def get_change_classifier(self) -> Callable[[T], str | None]:
+        return self._get_change_classifier(self.load_fingerprints())
+
+    def get_removed_keys(self, items: Iterable[T]) -> list[str]:
+        return self._get_removed_keys(self.load_fingerprints(), items)
+
+    def diff(self, items: Sequence[T]) -> StateDiff[T]:
+        fingerprints = self.load_fingerprints()
+        classify = self._get_change_classifier(fingerprints)
+        state_diff = StateDiff()
+        changes = {
+            ADDED: state_diff.added,
+            CHANGED: state_diff.changed,
+            VOLATILE_CHANGED: state_diff.volatile_changed
+        }
+        for item in items:
+            change = classify(item)
+            if change is not None:
+                changes[change].append(item)
+
+        state_diff.removed_keys = self._get_removed_keys(fingerprints, items)
+
+        logger.info(f"State difference: {len(state_diff.added)} added, "
+                    f"{len(state_diff.changed)} changed, "
+                    f"{len(state_diff.volatile_changed)} changed only in "
+                    f"volatile fields, {len(state_diff.removed_keys)} "
+                    f"removed.")
+        return state_diff
+
+    def update(self, items: Sequence[T]):
+        fingerprints = self.load_fingerprints()
+        changed_fingerprints = self._get_changed_fingerprints(
+            fingerprints, items)
+        with self._connection:
+            self._upsert(changed_fingerprints)
+
+    def dump(self, items: Sequence[T]):
+        fingerprints = self.load_fingerprints()
+        changed_fingerprints = self._get_changed_fingerprints(
+            fingerprints, items)
+        removed_keys = fingerprints.keys() - {
+            self._key(item) for item in items}
+        with self._connection:
+            self._upsert(changed_fingerprints)
+            self._connection.executemany(
+                "DELETE FROM state WHERE key = ?",
+                [(key,) for key in removed_keys])
+
+        logger.info(f"State was updated: {len(changed_fingerprints)} items "
+                    f"written, {len(removed_keys)} items removed.")
+
+    def _get_static_fingerprint(self, item: T) -> str:
+        return get_fingerprint(item, self._volatile_fields)
+
+    def _get_change_classifier(
+            self, fingerprints: dict[str, tuple[str, str | None]]
+    ) -> Callable[[T], str | None]:
+        def classify(item: T) -> str | None:
+            key = self._key(item)
+            if key not in fingerprints:
+                return ADDED
+
+            fingerprint, static_fingerprint = fingerprints[key]
+            if fingerprint == get_fingerprint(item):
+                return None
+            if static_fingerprint == self._get_static_fingerprint(item):
+                return VOLATILE_CHANGED
+            return CHANGED
+
+        return classify
+
+    def _get_removed_keys(
+            self, fingerprints: dict[str, tuple[str, str | None]],
+            items: Iterable[T]
+    ) -> list[str]:
+        return sorted(
+            fingerprints.keys() - {self._key(item) for item in items})
+
+    def _get_changed_fingerprints(
+            self, fingerprints: dict[str, tuple[str, str | None]],
+            items: Sequence[T]
+    ) -> dict[str, tuple[str, str]]:
+        changed_fingerprints = {}
         for item in items:
-            if item not in state:
-                not_presented.append(item)
+            key = self._key(item)
+            item_fingerprints = (
+                get_fingerprint(item), self._get_static_fingerprint(item))
+            if fingerprints.get(key) != item_fingerprints:
+                changed_fingerprints[key] = item_fingerprints
+        return changed_fingerprints
 
-        return not_presented
+    def _upsert(self, fingerprints: dict[str, tuple[str, str]]):
+        self._connection.executemany(
+            "INSERT INTO state (key, fingerprint, static_fingerprint) "
+            "VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE "
+            "SET fingerprint = excluded.fingerprint, "
+            "static_fingerprint = excluded.static_fingerprint",
+            [
+                (key, fingerprint, static_fingerprint)
+                for key, (fingerprint, static_fingerprint)
+                in fingerprints.items()
+            ])
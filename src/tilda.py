@@ -1,9 +1,18 @@
 import csv
+import gzip
+import io
+import json
+import shutil
+import time
+from dataclasses import dataclass, field
 from datetime import datetime
+from itertools import chain
 from pathlib import Path
-from typing import Iterable, Sequence
+from typing import BinaryIO, Iterable, Iterator, Self, Sequence
 
+import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.common import TimeoutException
 from selenium.webdriver.chrome.options import Options
@@ -11,8 +20,10 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.wait import WebDriverWait
+from urllib3.util import Retry
 
 from src.entities import Product
+from src.metrics import metrics
 
 BRAND_COLUMN = "Brand"
 SKU_COLUMN = "SKU"
@@ -31,107 +42,307 @@ CHARACTERISTIC_COLUMN = "Characteristic"
 class TildaCsvFileManager:
     def __init__(
             self, save_to: Path | str, filename_format: str,
-            products: Sequence[Product]
+            products: Iterable[Product],
+            max_rows_per_file: int | None = None,
+            max_file_size: int | None = None,
+            sort_products: bool = True,
+            compress: bool = False,
+            buffer_size: int = 1024 * 1024,
+            columns: Sequence[str] | None = None
     ):
-        self._filepath = None
-        self._is_empty_file = None
+        self._filepaths = []
         self._save_to = Path(save_to)
         self._filename_format = filename_format
+        if sort_products:
+            products = sorted(products, key=self._get_product_sort_key)
         self._products = products
+        self._max_rows_per_file = max_rows_per_file
+        self._max_file_size = max_file_size
+        self._compress = compress
+        self._buffer_size = buffer_size
 
-        self._characteristic_names = self._get_characteristic_names()
-        self._fieldnames = [
+        self._columns = [
             BRAND_COLUMN, SKU_COLUMN, CATEGORY_COLUMN, TITLE_COLUMN,
             DESCRIPTION_COLUMN, TEXT_COLUMN, PHOTO_COLUMN, PRICE_COLUMN,
             QUANTITY_COLUMN, OLD_PRICE_COLUMN, EXTERNAL_ID_COLUMN
         ]
-        self._fieldnames += self._characteristic_names
+        self._characteristic_column_indexes: dict[str, int] = {}
+        self._output_column_indexes = None
+        if columns is not None:
+            self._output_column_indexes = [
+                self._columns.index(column) for column in columns]
+
+        self._line_buffer = io.StringIO(newline="")
+        self._line_writer = csv.writer(self._line_buffer, delimiter=";")
 
     @property
     def filepath(self):
-        return self._filepath
+        if not self._filepaths:
+            return None
+        return self._filepaths[0]
+
+    @property
+    def filepaths(self) -> Sequence[Path]:
+        return self._filepaths
 
     def create_file(self):
+        self.create_files()
+
+    def create_files(self):
         current_datetime = datetime.now().strftime("%d_%m_%Y-%H_%M_%S")
-        filename = self._filename_format.format(datetime=current_datetime)
-        self._filepath = self._save_to / filename
+        self._filepaths = []
+
+        products = iter(self._products)
+        next_product = next(products, None)
+        part = 1
+        while next_product is not None:
+            filepath = self._save_to / self._get_filename(
+                current_datetime, part)
+            logger.info(f"Start creating a csv file {filepath}")
+            with metrics.time("csv_write_file"):
+                next_product = self._write_file(
+                    filepath, next_product, products)
+            metrics.increment("csv_files")
+            metrics.increment("csv_bytes", filepath.stat().st_size)
+            self._filepaths.append(filepath)
+            logger.info(f"Csv file {filepath} was created successfully")
+            part += 1
+
+    def _get_filename(self, current_datetime: str, part: int) -> str:
+        filename_format = self._filename_format
+        if "{part}" not in filename_format and part > 1:
+            filename_path = Path(filename_format)
+            filename_format = (
+                f"{filename_path.stem}_{{part}}{filename_path.suffix}")
+        filename = filename_format.format(
+            datetime=current_datetime, part=part)
+        if self._compress:
+            filename += ".gz"
+        return filename
+
+    def _write_file(
+            self, path: Path, first_product: Product,
+            products: Iterator[Product]
+    ) -> Product | None:
+        # Rows are written to a temporary file first, because the header
+        # is only known once all the characteristics of the file are seen.
+        rows_path = path.with_name(path.name + ".rows")
+        rows_number = 0
+        size = len(self._render_line(self._get_header()))
+        min_row_width = None
+        remaining_product = None
+
+        with rows_path.open(mode="wb", buffering=self._buffer_size) as file:
+            for product in chain([first_product], products):
+                row = self._get_product_csv_row(product)
+                line = self._render_line(row)
+
+                is_rows_limit_reached = (
+                    self._max_rows_per_file is not None and
+                    rows_number >= self._max_rows_per_file)
+                is_size_limit_reached = (
+                    self._max_file_size is not None and
+                    size + len(line) > self._max_file_size)
+                if rows_number > 0 and (
+                        is_rows_limit_reached or is_size_limit_reached):
+                    remaining_product = product
+                    break
+
+                file.write(line)
+                rows_number += 1
+                size += len(line)
+                if min_row_width is None or len(row) < min_row_width:
+                    min_row_width = len(row)
+
+        metrics.increment("csv_rows", rows_number)
+        try:
+            self._write_file_with_header(
+                path, rows_path, min_row_width == len(self._get_header()))
+        finally:
+            rows_path.unlink()
+
+        return remaining_product
+
+    def _write_file_with_header(
+            self, path: Path, rows_path: Path, is_rows_complete: bool):
+        with self._open_file(path) as file, \
+                rows_path.open(mode="rb") as rows_file:
+            header = self._get_header()
+            file.write(self._render_line(header))
+            if is_rows_complete:
+                shutil.copyfileobj(rows_file, file, self._buffer_size)
+                return
+
+            # Rows written before a new characteristic column was found
+            # are shorter than the header and are padded with empty values.
+            columns_number = len(header)
+            lines = io.TextIOWrapper(rows_file, encoding="utf-8", newline="")
+            for row in csv.reader(lines, delimiter=";"):
+                row += [None] * (columns_number - len(row))
+                file.write(self._render_line(row))
+
+    def _get_header(self) -> Sequence[str]:
+        if self._output_column_indexes is not None:
+            return [
+                self._columns[index] for index in self._output_column_indexes]
+        return self._columns
+
+    def _open_file(self, path: Path) -> BinaryIO:
+        if self._compress:
+            return gzip.open(path, mode="wb")
+        return path.open(mode="wb", buffering=self._buffer_size)
+
+    def _render_line(self, row: Sequence) -> bytes:
+        self._line_buffer.seek(0)
+        self._line_buffer.truncate()
+        self._line_writer.writerow(row)
+        return self._line_buffer.getvalue().encode("utf-8")
+
+    def _get_product_csv_row(self, product: Product) -> list:
+        row = [
+            product.brand,
+            product.sku,
+            ";".join(product.categories),
+            product.title,
+            product.description,
+            product.text,
+            product.image_url,
+            product.price,
+            product.quantity,
+            product.old_price,
+            product.external_id
+        ]
 
-        logger.info(f"Start creating a csv file {self._filepath}")
+        if self._output_column_indexes is not None:
+            return [row[index] for index in self._output_column_indexes]
 
-        rows = map(self._get_product_csv_dict_row, self._products)
-        self._write_file(self._filepath, rows)
+        for characteristic in product.characteristics:
+            if characteristic.name not in self._characteristic_column_indexes:
+                self._characteristic_column_indexes[characteristic.name] = (
+                    len(self._columns))
+                self._columns.append(
+                    f"{CHARACTERISTIC_COLUMN}:{characteristic.name}")
 
-        logger.info(f"Csv file {self._filepath} was created successfully")
+        row += [None] * (len(self._columns) - len(row))
+        for characteristic in product.characteristics:
+            index = self._characteristic_column_indexes[characteristic.name]
+            row[index] = characteristic.value
 
-    def _write_file(self, path: Path, rows: Iterable[dict]):
-        with path.open(mode="w", encoding="utf-8", newline="") as file:
-            writer = csv.DictWriter(
-                file, fieldnames=self._fieldnames, delimiter=";")
-            writer.writeheader()
-            writer.writerows(rows)
+        return row
 
-    def _get_characteristic_names(self) -> Sequence[str]:
-        characteristic_names = set()
-        for product in self._products:
-            characteristics = product.characteristics
-            for characteristic in characteristics:
-                characteristic_names.update(
-                    f"{CHARACTERISTIC_COLUMN}:{characteristic.name}")
-        return list(characteristic_names)
-
-    def _get_product_csv_dict_row(
-            self, product: Product) -> dict[str, str | float | int | None]:
-        csv_dict_row = {
-            BRAND_COLUMN: product.brand,
-            SKU_COLUMN: product.sku,
-            CATEGORY_COLUMN: ";".join(product.categories),
-            TITLE_COLUMN: product.title,
-            DESCRIPTION_COLUMN: product.description,
-            TEXT_COLUMN: product.text,
-            PHOTO_COLUMN: product.image_url,
-            PRICE_COLUMN: product.price,
-            QUANTITY_COLUMN: product.quantity,
-            OLD_PRICE_COLUMN: product.old_price,
-            EXTERNAL_ID_COLUMN: product.external_id
-        }
-
-        characteristics = dict.fromkeys(self._characteristic_names, None)
-        for characteristic in product.characteristics:
-            characteristics[characteristic.name] = characteristic.value
-        csv_dict_row.update(characteristics)
+    @staticmethod
+    def _get_product_sort_key(product: Product) -> tuple:
+        return (
+            product.brand, tuple(product.categories), product.sku,
+            product.external_id
+        )
 
-        return csv_dict_row
+
+class TildaImportError(RuntimeError):
+    pass
+
+
+@dataclass(slots=True)
+class TildaImportResult:
+    filepath: Path
+    status: str
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: Sequence[str] = field(default_factory=list)
 
 
 class TildaSeleniumCsvFileUploader:
     def __init__(
-            self, filepath: Path | str, email: str, password: str,
+            self, filepath: Path | str | None, email: str, password: str,
             project_id: str, selenium_timeout: float,
-            file_uploading_timeout: float
+            file_uploading_timeout: float,
+            user_data_dir: Path | str | None = None,
+            cookies_file: Path | str | None = None
     ):
         self._email = email
         self._password = password
         self._project_id = project_id
-        self._filepath = Path(filepath)
+        self._filepath = None if filepath is None else Path(filepath)
         self._selenium_timeout = selenium_timeout
         self._file_uploading_timeout = file_uploading_timeout
+        self._cookies_file = None
+        if cookies_file is not None:
+            self._cookies_file = Path(cookies_file)
 
         chrome_options = Options()
         chrome_options.add_argument("--headless")
         chrome_options.add_argument("--window-size=1920,1080")
+        if user_data_dir is not None:
+            chrome_options.add_argument(f"--user-data-dir={user_data_dir}")
         self._driver = webdriver.Chrome(options=chrome_options)
 
         self._driver.implicitly_wait(self._selenium_timeout)
+        self._is_logged_in = False
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._driver.quit()
 
-    def upload_file(self):
+    def upload_file(self) -> TildaImportResult | None:
+        results = self.upload_files([self._filepath])
+        if results:
+            return results[0]
+
+    def upload_files(
+            self, filepaths: Sequence[Path | str]
+    ) -> Sequence[TildaImportResult]:
+        if not self.login():
+            return []
+
+        results = []
+        for filepath in filepaths:
+            with metrics.time("tilda_upload_file", uploader="selenium"):
+                results.append(self._upload_file(Path(filepath)))
+        return results
+
+    def login(self) -> bool:
+        if self._is_logged_in:
+            return True
         try:
-            self._login_to_tilda()
+            with metrics.time("tilda_login", uploader="selenium"):
+                if not self._restore_session():
+                    self._login_to_tilda()
+                    self._save_cookies()
         except TimeoutException:
             logger.error("Error while logging in to the Tilda website. A "
                          "captcha or an incorrect login or password was "
                          "encountered.")
-        else:
-            self._upload_file()
+            return False
+
+        self._is_logged_in = True
+        return True
+
+    def _restore_session(self) -> bool:
+        if self._cookies_file is not None and self._cookies_file.is_file():
+            self._driver.get("https://tilda.cc/")
+            cookies = json.loads(self._cookies_file.read_text("utf-8"))
+            for cookie in cookies:
+                self._driver.add_cookie(cookie)
+
+        self._driver.get("https://tilda.cc/projects/")
+        is_logged_in = self._driver.current_url.startswith(
+            "https://tilda.cc/projects")
+        if is_logged_in:
+            logger.info("The previous session on the Tilda website is "
+                        "reused.")
+        return is_logged_in
+
+    def _save_cookies(self):
+        if self._cookies_file is None:
+            return
+        self._cookies_file.write_text(
+            json.dumps(self._driver.get_cookies()), "utf-8")
 
     def _login_to_tilda(self):
         logger.info("Start to login to Tilda website.")
@@ -151,8 +362,8 @@ class TildaSeleniumCsvFileUploader:
 
         logger.info("Successfully logged in to the Tilda website.")
 
-    def _upload_file(self):
-        logger.info(f"Start uploading a csv file {self._filepath.name} to "
+    def _upload_file(self, filepath: Path) -> TildaImportResult:
+        logger.info(f"Start uploading a csv file {filepath.name} to "
                     f"Tilda.")
 
         self._driver.get(
@@ -167,7 +378,7 @@ class TildaSeleniumCsvFileUploader:
         hidden_file_input = self._driver.find_element(
             By.CSS_SELECTOR, "input[type=\"file\"]"
         )
-        hidden_file_input.send_keys(str(self._filepath))
+        hidden_file_input.send_keys(str(filepath))
 
         self._driver.execute_script(
             "document.querySelector(`.js-import-load-data`).classList"
@@ -192,7 +403,154 @@ class TildaSeleniumCsvFileUploader:
                 results_element_locator))
         except TimeoutException:
             logger.error(f"Exceeded the timeout for uploading a csv file "
-                         f"{self._filepath.name} to the Tilda.")
+                         f"{filepath.name} to the Tilda.")
+            return TildaImportResult(filepath=filepath, status="timeout")
+
+        logger.info(f"Csv file {filepath.name} successfully uploaded to "
+                    f"Tilda.")
+        # The import page does not report the numbers of the products.
+        return TildaImportResult(filepath=filepath, status="done")
+
 
-        logger.info(f"Csv file {self._filepath.name} successfully uploaded to "
+class TildaHttpCsvFileUploader:
+    # Experimental. Tilda does not document an API for the store import, and
+    # the login, import and status endpoints below are assumed from the
+    # flow of the store admin page driven by the Selenium uploader. They
+    # were not verified against the live service.
+    def __init__(
+            self, filepath: Path | str | None, email: str, password: str,
+            project_id: str, timeout: float, file_uploading_timeout: float,
+            tilda_url: str = "https://tilda.cc",
+            store_url: str = "https://store.tilda.cc",
+            poll_interval: float = 2,
+            retries: int = 3
+    ):
+        self._email = email
+        self._password = password
+        self._project_id = project_id
+        self._filepath = None if filepath is None else Path(filepath)
+        self._timeout = timeout
+        self._file_uploading_timeout = file_uploading_timeout
+        self._tilda_url = tilda_url.rstrip("/")
+        self._store_url = store_url.rstrip("/")
+        self._poll_interval = poll_interval
+        self._is_logged_in = False
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=1,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET"]
+        )
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(max_retries=retry))
+        self._session.mount("https://", HTTPAdapter(max_retries=retry))
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._session.close()
+
+    def upload_file(self) -> TildaImportResult | None:
+        results = self.upload_files([self._filepath])
+        if results:
+            return results[0]
+
+    def upload_files(
+            self, filepaths: Sequence[Path | str]
+    ) -> Sequence[TildaImportResult]:
+        if not self.login():
+            return []
+
+        results = []
+        for filepath in filepaths:
+            with metrics.time("tilda_upload_file", uploader="http"):
+                results.append(self._upload_file(Path(filepath)))
+        return results
+
+    def login(self) -> bool:
+        if self._is_logged_in:
+            return True
+        try:
+            with metrics.time("tilda_login", uploader="http"):
+                self._login_to_tilda()
+        except requests.RequestException:
+            logger.error("Error while logging in to the Tilda website. A "
+                         "captcha or an incorrect login or password was "
+                         "encountered.")
+            return False
+        return True
+
+    def _login_to_tilda(self):
+        logger.info("Start to login to Tilda website.")
+
+        response = self._session.post(
+            f"{self._tilda_url}/login/submit/",
+            data={"email": self._email, "password": self._password},
+            timeout=self._timeout
+        )
+        response.raise_for_status()
+        if not response.url.startswith(f"{self._tilda_url}/projects"):
+            raise requests.HTTPError(
+                "Tilda did not redirect to the projects page after login.",
+                response=response)
+
+        self._is_logged_in = True
+        logger.info("Successfully logged in to the Tilda website.")
+
+    def _upload_file(self, filepath: Path) -> TildaImportResult:
+        logger.info(f"Start uploading a csv file {filepath.name} to "
                     f"Tilda.")
+
+        with filepath.open(mode="rb") as file:
+            response = self._session.post(
+                f"{self._store_url}/store/import/csv/",
+                data={"projectid": self._project_id},
+                files={"file": (filepath.name, file, "text/csv")},
+                timeout=self._timeout
+            )
+        response.raise_for_status()
+        import_id = response.json()["importid"]
+
+        result = self._wait_for_import(filepath, import_id)
+        if result.status == "done":
+            logger.info(f"Csv file {filepath.name} successfully uploaded to "
+                        f"Tilda: {result.created} created, {result.updated} "
+                        f"updated, {result.failed} failed.")
+        else:
+            logger.error(f"Failed to import a csv file {filepath.name} to "
+                         f"the Tilda, the import status is {result.status}.")
+        return result
+
+    def _wait_for_import(
+            self, filepath: Path, import_id: str) -> TildaImportResult:
+        deadline = time.monotonic() + self._file_uploading_timeout
+        while True:
+            response = self._session.get(
+                f"{self._store_url}/store/import/status/",
+                params={"projectid": self._project_id, "importid": import_id},
+                timeout=self._timeout
+            )
+            response.raise_for_status()
+            status = response.json()
+
+            if status["status"] != "processing":
+                return TildaImportResult(
+                    filepath=filepath,
+                    status=status["status"],
+                    created=status.get("created", 0),
+                    updated=status.get("updated", 0),
+                    failed=status.get("failed", 0),
+                    errors=status.get("errors", [])
+                )
+
+            if time.monotonic() >= deadline:
+                logger.error(f"Exceeded the timeout for uploading a csv file "
+                             f"{filepath.name} to the Tilda.")
+                return TildaImportResult(filepath=filepath, status="timeout")
+
+            time.sleep(self._poll_interval)
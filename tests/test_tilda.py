@@ -0,0 +1,259 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Settings are read from the environment when src.config is imported, so
+# the tests point them to a scratch directory beforehand.
+WORK_DIRECTORY = Path(tempfile.mkdtemp(prefix="autocube-tests-"))
+for name, value in {
+    "LOGFILE": str(WORK_DIRECTORY / "tests.log"),
+    "ODATA_URL": "http://127.0.0.1/odata/standard.odata/",
+    "ODATA_USERNAME": "test",
+    "ODATA_PASSWORD": "test",
+    "IMAGES_FOLDER": str(WORK_DIRECTORY / "images"),
+    "DEFAULT_IMAGE": "default.jpg",
+    "STATE_FILE": str(WORK_DIRECTORY / "state.pickle"),
+    "DROPBOX_REFRESH_TOKEN": "test",
+    "DROPBOX_APP_KEY": "test",
+    "DROPBOX_APP_SECRET": "test",
+    "CSV_FILES_DIRECTORY": str(WORK_DIRECTORY / "csv"),
+    "TILDA_EMAIL": "test",
+    "TILDA_PASSWORD": "test",
+    "TILDA_PROJECT_ID": "0",
+    "SELENIUM_TIMEOUT": "10",
+    "SELENIUM_FILE_UPLOADING_TIMEOUT": "10",
+}.items():
+    os.environ[name] = value
+(WORK_DIRECTORY / "csv").mkdir()
+
+from selenium.common import TimeoutException  # noqa: E402
+
+from src.entities import Characteristic, Product  # noqa: E402
+from src.main import upload_products_to_tilda  # noqa: E402
+from src.tilda import (  # noqa: E402
+    TildaCsvFileManager, TildaHttpCsvFileUploader, TildaImportError,
+    TildaSeleniumCsvFileUploader)
+from tests.tilda_server import TildaStandInServer  # noqa: E402
+
+EMAIL = "manager@example.com"
+PASSWORD = "secret"
+PROJECT_ID = "4242"
+
+
+def tearDownModule():
+    shutil.rmtree(WORK_DIRECTORY, ignore_errors=True)
+
+
+class TildaCsvFileManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp(dir=WORK_DIRECTORY))
+
+    def create_files(self, products: list[Product], **kwargs) -> list[list]:
+        file_manager = TildaCsvFileManager(
+            self.directory, "import_{part}.csv", products, **kwargs)
+        file_manager.create_files()
+        files = []
+        for filepath in file_manager.filepaths:
+            with filepath.open(encoding="utf-8", newline="") as file:
+                files.append(list(csv.reader(file, delimiter=";")))
+        return files
+
+    def assert_rows_match_header(self, files: list[list]):
+        for header, *rows in files:
+            for row in rows:
+                self.assertEqual(len(row), len(header))
+
+    def test_create_files_with_characteristics_and_rows_limit(self):
+        products = [
+            Product(external_id=str(number), title=f"Product {number}",
+                    characteristics=[Characteristic("Color", "red")])
+            for number in range(3)
+        ]
+
+        files = self.create_files(products, max_rows_per_file=1)
+
+        self.assertEqual(len(files), 3)
+        self.assert_rows_match_header(files)
+        self.assertEqual(
+            [rows[1][-2:] for rows in files],
+            [["0", "red"], ["1", "red"], ["2", "red"]])
+
+    def test_create_files_with_characteristics_and_size_limit(self):
+        products = [
+            Product(external_id=str(number), title=f"Product {number}",
+                    characteristics=[
+                        Characteristic(f"Size {number % 2}", "XL")])
+            for number in range(6)
+        ]
+
+        files = self.create_files(products, max_file_size=200)
+
+        self.assertGreater(len(files), 1)
+        self.assert_rows_match_header(files)
+        self.assertEqual(
+            [row[10] for rows in files for row in rows[1:]],
+            [str(number) for number in range(6)])
+
+
+class TildaHttpCsvFileUploaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = TildaStandInServer(EMAIL, PASSWORD, PROJECT_ID)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.directory = Path(tempfile.mkdtemp(dir=WORK_DIRECTORY))
+
+    def create_uploader(
+            self, password: str = PASSWORD,
+            file_uploading_timeout: float = 10
+    ) -> TildaHttpCsvFileUploader:
+        uploader = TildaHttpCsvFileUploader(
+            None, EMAIL, password, PROJECT_ID, timeout=10,
+            file_uploading_timeout=file_uploading_timeout,
+            tilda_url=self.server.url, store_url=self.server.url,
+            poll_interval=0.01, retries=0)
+        self.addCleanup(uploader.close)
+        return uploader
+
+    def create_csv_file(self, name: str, rows_number: int) -> Path:
+        filepath = self.directory / name
+        filepath.write_text(
+            "\n".join(["External ID;Title", *(
+                f"{number};Product {number}"
+                for number in range(rows_number)
+            )]) + "\n",
+            encoding="utf-8")
+        return filepath
+
+    def test_upload_files(self):
+        filepaths = [
+            self.create_csv_file("import_1.csv", 3),
+            self.create_csv_file("import_2.csv", 2)
+        ]
+
+        results = self.create_uploader().upload_files(filepaths)
+
+        self.assertEqual(
+            [(result.filepath, result.status, result.created)
+             for result in results],
+            [(filepaths[0], "done", 3), (filepaths[1], "done", 2)])
+        self.assertEqual(
+            [(item.filename, item.content)
+             for item in self.server.imports.values()],
+            [(filepath.name, filepath.read_bytes())
+             for filepath in filepaths])
+
+    def test_upload_files_logs_in_once(self):
+        uploader = self.create_uploader()
+
+        uploader.upload_files([self.create_csv_file("import_1.csv", 1)])
+        uploader.upload_files([self.create_csv_file("import_2.csv", 1)])
+
+        self.assertEqual(self.server.login_attempts_number, 1)
+        self.assertEqual(len(self.server.imports), 2)
+
+    def test_upload_files_with_incorrect_password(self):
+        uploader = self.create_uploader(password="incorrect")
+
+        results = uploader.upload_files(
+            [self.create_csv_file("import_1.csv", 1)])
+
+        self.assertEqual(results, [])
+        self.assertEqual(self.server.imports, {})
+
+    def test_upload_files_with_failed_import(self):
+        self.server.import_status = "failed"
+
+        results = self.create_uploader().upload_files(
+            [self.create_csv_file("import_1.csv", 2)])
+
+        self.assertEqual(
+            [(result.status, result.created, result.failed)
+             for result in results],
+            [("failed", 0, 2)])
+        self.assertEqual(results[0].errors, ["Import of import_1.csv failed."])
+
+    def test_upload_files_with_import_timeout(self):
+        self.server.processing_polls = 1_000_000
+
+        results = self.create_uploader(
+            file_uploading_timeout=0.05).upload_files(
+            [self.create_csv_file("import_1.csv", 1)])
+
+        self.assertEqual([result.status for result in results], ["timeout"])
+
+    def test_upload_products_to_tilda(self):
+        products = [Product(external_id="1", title="Product 1", quantity=1)]
+
+        upload_products_to_tilda(self.create_uploader(), products)
+
+        self.assertEqual(len(self.server.imports), 1)
+
+    def test_upload_products_to_tilda_with_failed_import(self):
+        self.server.import_status = "failed"
+        products = [Product(external_id="1", title="Product 1", quantity=1)]
+
+        with self.assertRaises(TildaImportError):
+            upload_products_to_tilda(self.create_uploader(), products)
+
+    def test_upload_products_to_tilda_with_failed_login(self):
+        products = [Product(external_id="1", title="Product 1", quantity=1)]
+
+        with self.assertRaises(TildaImportError):
+            upload_products_to_tilda(
+                self.create_uploader(password="incorrect"), products)
+
+
+
+class TildaSeleniumCsvFileUploaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.driver = mock.MagicMock()
+        self.driver.current_url = "https://tilda.cc/projects/"
+        self.waits = []
+        for target, value in {
+            "webdriver.Chrome": mock.Mock(return_value=self.driver),
+            "WebDriverWait": mock.Mock(side_effect=self.create_wait)
+        }.items():
+            patcher = mock.patch(f"src.tilda.{target}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.products = [
+            Product(external_id="1", title="Product 1", quantity=1)]
+
+    def create_wait(self, driver, timeout: float) -> mock.Mock:
+        wait = mock.Mock()
+        if self.waits:
+            wait.until.side_effect = self.waits.pop(0)
+        return wait
+
+    def create_uploader(self) -> TildaSeleniumCsvFileUploader:
+        uploader = TildaSeleniumCsvFileUploader(
+            None, EMAIL, PASSWORD, PROJECT_ID, selenium_timeout=1,
+            file_uploading_timeout=1)
+        self.addCleanup(uploader.close)
+        return uploader
+
+    def test_upload_products_to_tilda(self):
+        upload_products_to_tilda(self.create_uploader(), self.products)
+
+        self.assertTrue(self.driver.find_element.called)
+
+    def test_upload_products_to_tilda_with_failed_login(self):
+        self.driver.current_url = "https://tilda.cc/login/"
+        self.waits.append(TimeoutException())
+
+        with self.assertRaises(TildaImportError):
+            upload_products_to_tilda(self.create_uploader(), self.products)
+
+    def test_upload_products_to_tilda_with_import_timeout(self):
+        self.waits.append(TimeoutException())
+
+        with self.assertRaises(TildaImportError):
+            upload_products_to_tilda(self.create_uploader(), self.products)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+import json
+import secrets
+import threading
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Self
+from urllib.parse import parse_qs, urlsplit
+
+SESSION_COOKIE = "tildasid"
+
+
+@dataclass(slots=True)
+class StandInImport:
+    filename: str
+    content: bytes
+    rows_number: int
+    polls_left: int
+    status: str
+    errors: list[str] = field(default_factory=list)
+
+
+class TildaStandInServer:
+    # Implements the endpoints TildaHttpCsvFileUploader assumes, which are
+    # not confirmed against Tilda, so it only checks the client's side of
+    # that protocol. Serves both the Tilda and the store hosts, so the
+    # uploader is given the same url for tilda_url and store_url. Every
+    # import reports "processing" for processing_polls polls and then
+    # import_status.
+    def __init__(
+            self, email: str, password: str, project_id: str,
+            import_status: str = "done", processing_polls: int = 1,
+            port: int = 0
+    ):
+        self.email = email
+        self.password = password
+        self.project_id = project_id
+        self.import_status = import_status
+        self.processing_polls = processing_polls
+        self.imports: dict[str, StandInImport] = {}
+        self.login_attempts_number = 0
+        self._sessions: set[str] = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(
+            ("127.0.0.1", port), self._get_handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> Self:
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def login(self, email: str, password: str) -> str | None:
+        with self._lock:
+            self.login_attempts_number += 1
+            if (email, password) != (self.email, self.password):
+                return None
+            session = secrets.token_hex(16)
+            self._sessions.add(session)
+            return session
+
+    def is_logged_in(self, session: str | None) -> bool:
+        with self._lock:
+            return session in self._sessions
+
+    def start_import(self, filename: str, content: bytes) -> str:
+        rows_number = max(0, len(content.decode("utf-8").splitlines()) - 1)
+        errors = []
+        if self.import_status != "done":
+            errors.append(f"Import of {filename} failed.")
+        with self._lock:
+            import_id = str(len(self.imports) + 1)
+            self.imports[import_id] = StandInImport(
+                filename, content, rows_number, self.processing_polls,
+                self.import_status, errors)
+        return import_id
+
+    def poll_import(self, import_id: str) -> dict | None:
+        with self._lock:
+            item = self.imports.get(import_id)
+            if item is None:
+                return None
+            if item.polls_left > 0:
+                item.polls_left -= 1
+                return {"status": "processing"}
+            imported = item.rows_number if item.status == "done" else 0
+            return {
+                "status": item.status,
+                "created": imported,
+                "updated": 0,
+                "failed": item.rows_number - imported,
+                "errors": item.errors
+            }
+
+    def _get_handler_class(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/login/":
+                    self._send(200, "text/html", b"<form></form>")
+                elif url.path.startswith("/projects/"):
+                    if server.is_logged_in(self._get_session()):
+                        self._send(200, "text/html", b"<ul></ul>")
+                    else:
+                        self._redirect("/login/")
+                elif url.path == "/store/import/status/":
+                    self._get_import_status(parse_qs(url.query))
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                if path == "/login/submit/":
+                    self._submit_login()
+                elif path == "/store/import/csv/":
+                    self._import_csv()
+                else:
+                    self.send_error(404)
+
+            def _submit_login(self):
+                form = parse_qs(self._read_body().decode("utf-8"))
+                session = server.login(
+                    form.get("email", [""])[0],
+                    form.get("password", [""])[0])
+                if session is None:
+                    self._redirect("/login/?error=1")
+                else:
+                    self._redirect("/projects/", session)
+
+            def _import_csv(self):
+                if not server.is_logged_in(self._get_session()):
+                    self.send_error(403)
+                    return
+                message = BytesParser(policy=HTTP).parsebytes(
+                    b"Content-Type: " +
+                    self.headers["Content-Type"].encode("latin-1") +
+                    b"\r\n\r\n" + self._read_body())
+                parts = {
+                    part.get_param("name", header="content-disposition"):
+                        part
+                    for part in message.iter_parts()
+                }
+                if ("file" not in parts or "projectid" not in parts or
+                        parts["projectid"].get_content().strip() !=
+                        server.project_id):
+                    self.send_error(400)
+                    return
+                import_id = server.start_import(
+                    parts["file"].get_filename(),
+                    parts["file"].get_payload(decode=True))
+                self._send_json({"importid": import_id})
+
+            def _get_import_status(self, params: dict[str, list[str]]):
+                if not server.is_logged_in(self._get_session()):
+                    self.send_error(403)
+                    return
+                if params.get("projectid") != [server.project_id]:
+                    self.send_error(400)
+                    return
+                status = server.poll_import(params.get("importid", [""])[0])
+                if status is None:
+                    self.send_error(404)
+                    return
+                self._send_json(status)
+
+            def _get_session(self) -> str | None:
+                cookie = SimpleCookie(self.headers.get("Cookie", ""))
+                morsel = cookie.get(SESSION_COOKIE)
+                return None if morsel is None else morsel.value
+
+            def _read_body(self) -> bytes:
+                return self.rfile.read(
+                    int(self.headers.get("Content-Length", 0)))
+
+            def _redirect(self, location: str, session: str | None = None):
+                self.send_response(302)
+                self.send_header("Location", location)
+                if session is not None:
+                    self.send_header(
+                        "Set-Cookie", f"{SESSION_COOKIE}={session}; Path=/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _send_json(self, body: dict):
+                self._send(
+                    200, "application/json",
+                    json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+            def _send(self, code: int, content_type: str, content: bytes):
+                self.send_response(code)
+                self.send_header(
+                    "Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler